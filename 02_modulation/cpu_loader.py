@@ -1,42 +1,248 @@
 import multiprocessing as mp
+import threading
 import time
 import psutil
 
+# segments per chunk of a timeline; every worker holds two chunks in shared memory, the one it executes and the
+# next one
+TIMELINE_CAPACITY = 4096
+
+# waits sleep until this long (ns) before their deadline and spin for the rest; the margin follows the
+# observed sleep overshoot, within these bounds
+MIN_SPIN_MARGIN = 20000
+MAX_SPIN_MARGIN = 1000000
+
+# longest single sleep (s), so waiting workers still notice a new timeline or stop(), and the feeder a progress
+# notification it missed
+MAX_SLEEP = 0.1
+
 
 class CpuLoader:
+    """
+    Loads CPU cores with one long-lived worker process per core, pinned to it with cpu_affinity.
+    Workers are started once and then steered through shared memory: each one executes a timeline of
+    (start_ns, end_ns, half_period_ns) segments in absolute time.monotonic_ns time. Within a segment the
+    core is busy for a half period, idle for a half period, and so on, every edge being computed from the
+    segment start, so late edges never accumulate into drift. Timelines of any length are handed over in chunks
+    while they are executed (see schedule_timeline):
+    >>> with CpuLoader() as cl:
+    ...     cl.load_cpu(0.001)
+    ...     cl.run_timeline([(start, start + 10 ** 9, 250000)])
+    """
+
     def __init__(self):
-        self.cpu_count = mp.cpu_count()
+        self.cores = sorted(psutil.Process().cpu_affinity())
+        self.cpu_count = len(self.cores)
+
+        # per worker: two chunk slots of its timeline and the number of segments in each, then the number of chunks
+        # of the timeline, how many have been written (chunk k goes to slot k % 2) and how many the worker is done
+        # with, and a generation counter that is incremented to hand a new timeline over; the worker acknowledges
+        # the generation its done count belongs to
+        self.timelines = mp.RawArray('q', 2 * 3 * TIMELINE_CAPACITY * self.cpu_count)
+        self.lengths = mp.RawArray('q', 2 * self.cpu_count)
+        self.chunks = mp.RawArray('q', self.cpu_count)
+        self.written = mp.RawArray('q', self.cpu_count)
+        self.done = mp.RawArray('q', self.cpu_count)
+        self.acked = mp.RawArray('q', self.cpu_count)
+        self.generations = mp.RawArray('q', self.cpu_count)
+        self.running = mp.RawValue('b', 0)
+        # per worker: set on a new timeline, a new chunk and stop(), idle workers block on it; the workers set
+        # progress when they acknowledge a timeline or finish a chunk, the feeder blocks on it
+        self.wakeups = [mp.Event() for _ in range(self.cpu_count)]
+        self.progress = mp.Event()
+        self.workers = []
+        # threads writing the chunks of long timelines
+        self.feeders = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
 
     @staticmethod
-    def busy_wait(end_time: time) -> None:
-        """Make CPU busy with random variable assignments until provided datetime"""
-        while time.time() < end_time:
+    def busy_wait(end_ns: int) -> None:
+        """Make CPU busy until the provided time.monotonic_ns() timestamp"""
+        while time.monotonic_ns() < end_ns:
             pass
 
-    def spawn_child(self, worker: int, end_time: time) -> None:
-        """Spawn child with proper affinity"""
-        p = psutil.Process()
-        p.cpu_affinity([worker])
-        self.busy_wait(end_time)
+    @staticmethod
+    def wait_until(deadline_ns: int, margin_ns: int, abort=None) -> int:
+        """
+        Hybrid wait: sleeps until margin_ns before deadline_ns and spins for the rest.
+        Returns the updated spin margin (following the sleep overshoot), or -1 if abort() became true.
+        """
+        while True:
+            remaining = deadline_ns - time.monotonic_ns()
+            if remaining <= margin_ns:
+                break
+            if abort is not None and abort():
+                return -1
+            sleep_ns = min(remaining - margin_ns, int(MAX_SLEEP * 1e9))
+            wake_ns = time.monotonic_ns() + sleep_ns
+            time.sleep(sleep_ns / 1e9)
+            overshoot = time.monotonic_ns() - wake_ns
+            margin_ns = min(max((7 * margin_ns + 2 * overshoot) // 8, MIN_SPIN_MARGIN), MAX_SPIN_MARGIN)
+        while time.monotonic_ns() < deadline_ns:
+            pass
+        return margin_ns
+
+    @staticmethod
+    def worker(idx: int, core: int, timelines, lengths, chunks, written, done, acked, generations, running,
+               wakeup, progress) -> None:
+        """Worker main loop: pinned to core, executes every timeline handed over to it, chunk by chunk"""
+        psutil.Process().cpu_affinity([core])
+        margin = MIN_SPIN_MARGIN
+        seen = 0
+        while running.value:
+            # cleared before the check, so a timeline handed over in between still wakes the worker up
+            wakeup.clear()
+            generation = generations[idx]
+            if generation == seen:
+                wakeup.wait()
+                continue
+            seen = generation
+            done[idx] = 0
+            acked[idx] = seen
+            progress.set()
+
+            def aborted():
+                return not running.value or generations[idx] != seen
+
+            for chunk in range(chunks[idx]):
+                while True:
+                    wakeup.clear()
+                    if written[idx] > chunk or aborted():
+                        break
+                    wakeup.wait()
+                if aborted():
+                    break
+                slot = 2 * idx + chunk % 2
+                base = 3 * TIMELINE_CAPACITY * slot
+                for segment in range(lengths[slot]):
+                    start, end, half_period = timelines[base + 3 * segment:base + 3 * segment + 3]
+                    on = start
+                    while on < end:
+                        off = min(on + half_period, end)
+                        # an edge that is already over is skipped, the following ones stay where they belong
+                        if time.monotonic_ns() < off:
+                            margin = CpuLoader.wait_until(on, margin, aborted)
+                            if margin < 0:
+                                margin = MIN_SPIN_MARGIN
+                                break
+                            CpuLoader.busy_wait(off)
+                        on += 2 * half_period
+                    if aborted():
+                        break
+                if aborted():
+                    break
+                # frees the slot for the chunk after the next one
+                done[idx] = chunk + 1
+                progress.set()
+
+    def start(self):
+        """Spawn the worker processes (once), returns self"""
+        if not self.workers:
+            self.running.value = 1
+            for idx, core in enumerate(self.cores):
+                p = mp.Process(target=self.worker, daemon=True,
+                               args=(idx, core, self.timelines, self.lengths, self.chunks, self.written, self.done,
+                                     self.acked, self.generations, self.running, self.wakeups[idx], self.progress))
+                p.start()
+                self.workers.append(p)
+        return self
+
+    def stop(self) -> None:
+        """Stop and join the worker processes"""
+        self.running.value = 0
+        for wakeup in self.wakeups:
+            wakeup.set()
+        self.progress.set()
+        for p in self.workers:
+            p.join()
+        for feeder in self.feeders:
+            feeder.join()
+        self.workers = []
+        self.feeders = []
+
+    def core_groups(self, n_groups: int) -> list:
+        """Splits the core indices into n_groups contiguous groups of (nearly) equal size"""
+        if not 0 < n_groups <= self.cpu_count:
+            raise ValueError("Can't split " + str(self.cpu_count) + " cores into " + str(n_groups) + " groups")
+        return [range(i * self.cpu_count // n_groups, (i + 1) * self.cpu_count // n_groups)
+                for i in range(n_groups)]
+
+    def schedule_timeline(self, segments, cores=None) -> None:
+        """
+        Hands a timeline of (start_ns, end_ns, half_period_ns) segments to the given core indices (default: all),
+        replacing whatever they were executing. Returns immediately.
+        The timeline is split into chunks of TIMELINE_CAPACITY segments. The first two are written right away, the
+        others by a feeder thread, each one as soon as the workers are done with the chunk two before it.
+        """
+        cores = list(range(self.cpu_count) if cores is None else cores)
+        self.start()
+        chunks = [segments[idx:idx + TIMELINE_CAPACITY] for idx in range(0, len(segments), TIMELINE_CAPACITY)]
+        generations = {}
+        for idx in cores:
+            self.chunks[idx] = len(chunks)
+            self.written[idx] = 0
+            self.generations[idx] += 1
+            generations[idx] = self.generations[idx]
+            self.wakeups[idx].set()
+        # the feeders of the replaced timelines return
+        self.progress.set()
+        for chunk in range(min(len(chunks), 2)):
+            self.write_chunk(chunk, chunks[chunk], cores)
+        if len(chunks) > 2:
+            self.feeders = [feeder for feeder in self.feeders if feeder.is_alive()]
+            feeder = threading.Thread(target=self.feed, args=(chunks, generations), daemon=True)
+            feeder.start()
+            self.feeders.append(feeder)
+
+    def write_chunk(self, chunk: int, segments, cores) -> None:
+        """Writes the chunk-th chunk of a timeline to its slot of every given core index"""
+        for idx in cores:
+            slot = 2 * idx + chunk % 2
+            base = 3 * TIMELINE_CAPACITY * slot
+            for segment, (start, end, half_period) in enumerate(segments):
+                self.timelines[base + 3 * segment:base + 3 * segment + 3] = [start, end, max(int(half_period), 1)]
+            self.lengths[slot] = len(segments)
+            self.written[idx] = chunk + 1
+            self.wakeups[idx].set()
+
+    def feed(self, chunks, generations) -> None:
+        """
+        Feeder thread of schedule_timeline: writes the chunks from the third one on to the core indices of
+        generations (core index: generation of the timeline), until they are replaced by another timeline
+        """
+        for chunk in range(2, len(chunks)):
+            while True:
+                self.progress.clear()
+                if not any(self.acked[idx] != generation or self.done[idx] < chunk - 1
+                           for idx, generation in generations.items()):
+                    break
+                if not self.running.value or any(self.generations[idx] != generation
+                                                 for idx, generation in generations.items()):
+                    return
+                self.progress.wait(MAX_SLEEP)
+            self.write_chunk(chunk, chunks[chunk], generations)
+
+    def run_timeline(self, segments, cores=None) -> None:
+        """Like schedule_timeline, but blocks until the end of the last segment"""
+        self.schedule_timeline(segments, cores)
+        if segments:
+            self.wait_until(max(end for _, end, _ in segments), MIN_SPIN_MARGIN)
 
     def load_cpu(self, duration: float, num_cpu=None) -> None:
         """Load the CPU (all cores) for a specified duration"""
         if num_cpu is None:
             num_cpu = self.cpu_count
-        end_time = time.time() + duration
-        with mp.Pool() as pool:
-            # Populate CPU
-            for w in range(0, num_cpu):
-                pool.apply_async(self.spawn_child, (w, end_time))
-
-            # Wait for children to finish
-            pool.close()
-            pool.join()
+        start_ns = time.monotonic_ns()
+        end_ns = start_ns + int(duration * 1e9)
+        self.run_timeline([(start_ns, end_ns, end_ns - start_ns)], range(min(num_cpu, self.cpu_count)))
 
     def load_core(self, duration: float, core: int) -> None:
         """Loads a specific core of the CPU for a specified duration"""
-        end_time = time.time() + duration
-        with mp.Pool() as pool:
-            pool.apply(self.spawn_child, (core % self.cpu_count, end_time))
-        pool.close()
-        pool.join()
+        start_ns = time.monotonic_ns()
+        end_ns = start_ns + int(duration * 1e9)
+        self.run_timeline([(start_ns, end_ns, end_ns - start_ns)], [core % self.cpu_count])
@@ -0,0 +1,43 @@
+"""
+Forward error correction for the modulator: systematic Hamming codes, shortened to any number of data bits per
+codeword. Each codeword carries data_bits data bits followed by the fewest parity bits that still correct one
+flipped bit, e.g. 4 -> Hamming(7,4), 8 -> (12,8), 11 -> (15,11), 26 -> (31,26). The demodulator's
+fec_decoder.py decodes them.
+"""
+
+
+def parity_bits(data_bits: int) -> int:
+    """Number of parity bits of a Hamming code with data_bits data bits per codeword"""
+    r = 2
+    while 2 ** r - r - 1 < data_bits:
+        r += 1
+    return r
+
+
+def parity_columns(data_bits: int) -> list:
+    """
+    Parity check columns of the data bits: the smallest r-bit values that aren't powers of two (those belong to the
+    parity bits themselves), so every single bit error has its own, non-zero syndrome
+    """
+    r = parity_bits(data_bits)
+    return [value for value in range(3, 2 ** r) if value & (value - 1)][:data_bits]
+
+
+def encode(bits: str, data_bits: int) -> str:
+    """
+    Encodes a string of 1s and 0s. It is padded with a 1 and as many 0s as needed to fill the last codeword, so the
+    receiver can strip the padding again.
+    """
+    r = parity_bits(data_bits)
+    columns = parity_columns(data_bits)
+    bits += "1" + "0" * (-(len(bits) + 1) % data_bits)
+
+    res = []
+    for start in range(0, len(bits), data_bits):
+        block = bits[start:start + data_bits]
+        syndrome = 0
+        for bit, column in zip(block, columns):
+            if bit == "1":
+                syndrome ^= column
+        res.append(block + format(syndrome, "0" + str(r) + "b"))
+    return "".join(res)
@@ -0,0 +1,71 @@
+"""
+Packetization of files for the Python modulator. A file is read chunk by chunk and every chunk becomes one packet:
+preamble (10101010), sequence number (1 byte), payload bytes and a CRC-8 over sequence number and payload:
+>>> for frame in iter_file_frames("test.txt", packet_size=16):
+...     generate_bfsk(frame)
+Packets are generated lazily, so a file is never held in memory as a whole, and a corrupted packet only
+loses its own payload. Optionally, everything after the preamble is protected by a Hamming code (see fec_encoder.py).
+"""
+import fec_encoder
+
+PREAMBLE = "10101010"
+
+# payload bytes per packet
+PACKET_SIZE = 16
+
+
+def make_crc8_table(poly=0x07) -> list:
+    """Lookup table of the CRC-8 of every byte value, for the polynomial poly (MSB first, no reflection)"""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+# CRC-8/SMBUS (polynomial 0x07, initial value 0), as checked by the demodulator
+CRC8_TABLE = make_crc8_table()
+
+
+def crc8(data: bytes, crc=0) -> int:
+    """CRC-8 of the bytes data, one table lookup per byte; crc continues a previous calculation"""
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def build_packet(seq: int, payload: bytes) -> bytes:
+    """Sequence number (modulo 256), payload and CRC-8 of both, without the preamble"""
+    body = bytes([seq % 256]) + payload
+    return body + bytes([crc8(body)])
+
+
+def to_bits(data: bytes) -> str:
+    """Bytes as a string of 1s and 0s, MSB first"""
+    return "".join(format(byte, "08b") for byte in data)
+
+
+def iter_packets(fileobj, packet_size=PACKET_SIZE):
+    """Reads fileobj (opened in binary mode) packet_size bytes at a time, yields one packet per chunk"""
+    seq = 0
+    while True:
+        payload = fileobj.read(packet_size)
+        if not payload:
+            return
+        yield build_packet(seq, payload)
+        seq += 1
+
+
+def iter_file_frames(filepath: str, packet_size=PACKET_SIZE, fec_data_bits=None):
+    """
+    Yields the bit string (preamble included) of every packet of the file at filepath, Hamming encoded with
+    fec_data_bits data bits per codeword if given
+    """
+    with open(filepath, "rb") as fileobj:
+        for packet in iter_packets(fileobj, packet_size):
+            bits = to_bits(packet)
+            if fec_data_bits is not None:
+                bits = fec_encoder.encode(bits, fec_data_bits)
+            yield PREAMBLE + bits
@@ -1,21 +1,79 @@
 from cpu_loader import CpuLoader
+from framing import PACKET_SIZE, PREAMBLE, iter_file_frames
+import argparse
 import time
 
+# delay (s) between compiling a timeline and its first edge, so every worker has picked it up by then
+START_DELAY = 0.05
 
-def generate_signal(duration, freq: int) -> None:
+# idle symbol periods between two packets, the demodulator ends a frame after two silent ones
+PACKET_GAP_SYMBOLS = 3
+
+
+def half_period_ns(freq: int) -> int:
+    """Length of each load and idle interval for the switching frequency freq, in ns"""
+    return int(1e9 / (0.5 * freq))
+
+
+def compile_timeline(freqs: list, symbol_freq: float, start_ns: int) -> list:
+    """
+    Compiles a sequence of symbol frequencies into a CpuLoader timeline, one (start_ns, end_ns, half_period_ns)
+    segment per run of symbols with the same frequency. Symbol boundaries are computed from start_ns directly, so
+    they don't drift over long payloads.
+    """
+    symbol_ns = 1e9 / symbol_freq
+    timeline = []
+    for idx, freq in enumerate(freqs):
+        start, end = start_ns + round(idx * symbol_ns), start_ns + round((idx + 1) * symbol_ns)
+        if timeline and timeline[-1][2] == half_period_ns(freq):
+            # the load keeps switching across the symbol boundary, its edges are computed from the run start
+            timeline[-1] = (timeline[-1][0], end, timeline[-1][2])
+        else:
+            timeline.append((start, end, half_period_ns(freq)))
+    return timeline
+
+
+def bfsk_freqs(data: str, high_freq: int, low_freq: int) -> list:
+    """Symbol frequencies of a string of 1s and 0s"""
+    if any(elem not in "01" for elem in data):
+        raise ValueError("Data wasn't in binary format!")
+    return [high_freq if elem == "1" else low_freq for elem in data]
+
+
+def mfsk_freqs(data: str, tones: list) -> list:
+    """
+    Symbol frequencies of an M-FSK frame for the payload data (1s and 0s): the preamble alternates between tones[1]
+    and tones[0], then every log2(M) bits select one of the M tones (MSB first, the last symbol padded with 0s)
+    """
+    bits_per_symbol = len(tones).bit_length() - 1
+    if len(tones) < 2 or len(tones) != 2 ** bits_per_symbol:
+        raise ValueError("The number of tones must be a power of two, got " + str(len(tones)))
+    if any(elem not in "01" for elem in data):
+        raise ValueError("Data wasn't in binary format!")
+    data += "0" * (-len(data) % bits_per_symbol)
+    return [tones[int(elem)] for elem in PREAMBLE] + \
+        [tones[int(data[idx:idx + bits_per_symbol], 2)] for idx in range(0, len(data), bits_per_symbol)]
+
+
+def compile_bfsk_timeline(data: str, bfsk_freq: float, high_freq: int, low_freq: int, start_ns: int) -> list:
+    """Compiles a BFSK transmission into a CpuLoader timeline, see compile_timeline"""
+    return compile_timeline(bfsk_freqs(data, high_freq, low_freq), bfsk_freq, start_ns)
+
+
+def generate_signal(duration, freq) -> None:
     """
     Generating different frequencies is achieved by changing the frequency of CPU load switching.
+    freq may also be a list of frequencies, which are then generated one after the other for duration each.
     """
+    freqs = freq if isinstance(freq, list) else [freq]
 
     # print info
     print("---Generating Signal---")
-    print("Duration: " + str(duration) + " s")
+    print("Duration: " + str(duration * len(freqs)) + " s")
     print("# Cores: " + str(cl.cpu_count) + " ")
 
-    start_time = time.time()
-    while start_time + duration > time.time():
-        cl.load_cpu(1 / (0.5 * freq))
-        time.sleep(1 / (0.5 * freq))
+    # the whole sequence is handed to the load workers at once, which execute it edge by edge
+    cl.run_timeline(compile_timeline(freqs, 1 / duration, time.monotonic_ns() + int(START_DELAY * 1e9)))
 
 
 def generate_sweep_signal(duration: float) -> None:
@@ -35,23 +93,128 @@ def generate_bfsk(data: str, bfsk_freq=1.0, high_freq=20000, low_freq=10000) ->
 
     print("Broadcasting BFSK signal for data: " + data)
     print("Approximate duration: " + str(len(data) / bfsk_freq) + " seconds")
+    try:
+        freqs = bfsk_freqs(data, high_freq, low_freq)
+    except ValueError as err:
+        print(err)
+        return
     start = time.time()
-    for elem in data:
-        if elem == "0":
-            generate_signal(1 / bfsk_freq, low_freq)
-        elif elem == "1":
-            generate_signal(1 / bfsk_freq, high_freq)
-        else:
-            print("Data wasn't in binary format!")
-            return
+    generate_signal(1 / bfsk_freq, freqs)
     print("Success! BFSK signal lasted for " + str(time.time() - start) + " seconds.")
 
 
-def ofdm_test():
-    pass
+def generate_mfsk(data: str, tones: list, symbol_freq=1.0) -> None:
+    """
+    Generate an M-FSK frame (preamble included, see mfsk_freqs) for the parsed payload data, consisting of 1s and 0s.
+    With M tones, every symbol carries log2(M) bits.
+    """
+    print("Broadcasting " + str(len(tones)) + "-FSK signal for data: " + data)
+    try:
+        freqs = mfsk_freqs(data, tones)
+    except ValueError as err:
+        print(err)
+        return
+    print("Approximate duration: " + str(len(freqs) / symbol_freq) + " seconds")
+    start = time.time()
+    generate_signal(1 / symbol_freq, freqs)
+    print("Success! M-FSK signal lasted for " + str(time.time() - start) + " seconds.")
+
+
+def generate_fdm(data: list, channels: list, bfsk_freq=1.0) -> None:
+    """
+    Frequency-division multiplexing: the cores are split into one group per channel, and every group transmits
+    its own BFSK signal (data[i], 1s and 0s) on its own pair of channels[i] = (high_freq, low_freq) at the same
+    time. The demodulator separates the channels again (see Demodulator's channels).
+    """
+    print("Broadcasting " + str(len(channels)) + " channels at once")
+    groups = cl.core_groups(len(channels))
+    start_ns = time.monotonic_ns() + int(START_DELAY * 1e9)
+    end_ns = start_ns
+    for elem, (high_freq, low_freq), cores in zip(data, channels, groups):
+        print("Cores " + str(list(cores)) + " (" + str(high_freq) + " / " + str(low_freq) + " Hz): " + elem)
+        timeline = compile_bfsk_timeline(elem, bfsk_freq, high_freq, low_freq, start_ns)
+        cl.schedule_timeline(timeline, cores)
+        end_ns = max(end_ns, timeline[-1][1])
+    cl.wait_until(end_ns, 0)
+
+
+def generate_file(filepath: str, packet_size=PACKET_SIZE, bfsk_freq=1.0, high_freq=20000, low_freq=10000,
+                  tones=None, channels=None, fec_data_bits=None) -> None:
+    """
+    Transmit a file as a sequence of packets (see framing.py), each one a BFSK frame of its own
+    (M-FSK if a table of tones is given).
+    Packets are built one at a time while the previous one is being transmitted, and every packet starts
+    PACKET_GAP_SYMBOLS symbol periods after the scheduled end of the previous one.
+    With a list of (high_freq, low_freq) channels, as many packets are sent at once on separate core groups
+    (see generate_fdm). With fec_data_bits, packets are Hamming encoded (see fec_encoder.py).
+    """
+    print("Broadcasting file " + filepath + " in packets of " + str(packet_size) + " bytes")
+    if channels is None:
+        channels = [(high_freq, low_freq)]
+    groups = cl.core_groups(len(channels))
+    start = time.time()
+    packet_start = time.monotonic_ns() + int(START_DELAY * 1e9)
+    frames = iter_file_frames(filepath, packet_size, fec_data_bits)
+    seq = 0
+    while True:
+        packet_end = packet_start
+        for (channel_high, channel_low), cores in zip(channels, groups):
+            frame = next(frames, None)
+            if frame is None:
+                break
+            if tones is None:
+                freqs = bfsk_freqs(frame, channel_high, channel_low)
+            else:
+                freqs = mfsk_freqs(frame[len(PREAMBLE):], tones)
+            timeline = compile_timeline(freqs, bfsk_freq, packet_start)
+            cl.schedule_timeline(timeline, cores)
+            print("Packet " + str(seq) + ": " + frame)
+            packet_end = max(packet_end, timeline[-1][1])
+            seq += 1
+        if packet_end == packet_start:
+            break
+
+        # wait for the packets to be over, the next ones are compiled in the gap
+        cl.wait_until(packet_end, 0)
+        packet_start = packet_end + round(PACKET_GAP_SYMBOLS * 1e9 / bfsk_freq)
+    print("Success! File transmission lasted for " + str(time.time() - start) + " seconds.")
 
 
 if __name__ == "__main__":
-    cl = CpuLoader()
-    print("Number of available cores: " + str(cl.cpu_count))
-    generate_bfsk("10101010", low_freq=1000, high_freq=2000)
+    parser = argparse.ArgumentParser(description="PowerSupplay modulator")
+    parser.add_argument("--file",
+                        help="File to transmit in packets (default: transmit the preamble only)",
+                        default=None,
+                        dest="file",
+                        type=str)
+    parser.add_argument("--packet-size",
+                        help="Payload bytes per packet",
+                        default=PACKET_SIZE,
+                        dest="packet_size",
+                        type=int)
+    parser.add_argument("--tones",
+                        help="Comma separated M-FSK tone table (4 or 8 tones), default: BFSK",
+                        default=None,
+                        dest="tones",
+                        type=lambda tones: [int(tone) for tone in tones.split(",")])
+    parser.add_argument("--channels",
+                        help="Comma separated high:low frequency pairs, one channel per core group (BFSK only)",
+                        default=None,
+                        dest="channels",
+                        type=lambda channels: [tuple(int(freq) for freq in channel.split(":"))
+                                               for channel in channels.split(",")])
+    parser.add_argument("--fec",
+                        help="Hamming encode packets with this many data bits per codeword (e.g. 4, 11, 26)",
+                        default=None,
+                        dest="fec",
+                        type=int)
+    args = parser.parse_args()
+
+    # the workers are started once and kept for the whole transmission
+    with CpuLoader() as cl:
+        print("Number of available cores: " + str(cl.cpu_count))
+        if args.file is None:
+            generate_bfsk("10101010", low_freq=1000, high_freq=2000)
+        else:
+            generate_file(args.file, args.packet_size, low_freq=1000, high_freq=2000, tones=args.tones,
+                          channels=args.channels, fec_data_bits=args.fec)
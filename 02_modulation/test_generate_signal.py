@@ -0,0 +1,27 @@
+"""Tests of the modulator's timelines: $ python -m pytest"""
+import time
+
+from cpu_loader import TIMELINE_CAPACITY, CpuLoader
+from generate_signal import bfsk_freqs, compile_timeline, half_period_ns
+
+
+def test_compile_timeline_merges_runs():
+    timeline = compile_timeline(bfsk_freqs("1100010", 2000, 1000), 10, 0)
+    assert timeline == [(0, 200000000, half_period_ns(2000)), (200000000, 500000000, half_period_ns(1000)),
+                        (500000000, 600000000, half_period_ns(2000)), (600000000, 700000000, half_period_ns(1000))]
+
+
+def test_long_timeline_is_fed_in_chunks():
+    # more than two chunks of short segments, alternating so none of them are merged
+    freqs = bfsk_freqs("10" * (5 * TIMELINE_CAPACITY // 4), 2000, 1000)
+    start_ns = time.monotonic_ns() + 50000000
+    timeline = compile_timeline(freqs, 20000, start_ns)
+    assert len(timeline) > 2 * TIMELINE_CAPACITY
+
+    with CpuLoader() as cl:
+        cl.run_timeline(timeline, [0])
+        deadline = time.monotonic() + 5
+        while cl.done[0] < cl.chunks[0] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cl.chunks[0] == 3
+        assert cl.done[0] == 3
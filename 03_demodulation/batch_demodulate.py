@@ -0,0 +1,124 @@
+"""
+Batch demodulation: decodes many recordings in parallel, one file per worker process.
+Arguments are WAV files, directories (all *.wav files in them) or glob patterns:
+$ python batch_demodulate.py recordings/ more/*.wav --output results.jsonl
+One JSON line is written per recording, in the order they finish. A recording that can't be decoded
+gets a line with its error instead, and the batch carries on.
+"""
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import traceback
+
+from colorama import Fore
+
+import demodulate_bfsk as demod
+from feature_cache import MAX_BYTES, FeatureCache
+
+# demodulator (and feature cache) of the current worker process, created once by init_worker
+_demodulator = None
+_block_seconds = None
+_cache = None
+
+
+def find_recordings(patterns):
+    """Expands files, directories and glob patterns to a sorted list of WAV files, without duplicates"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, "*.wav")))
+        elif os.path.isfile(pattern):
+            paths.add(pattern)
+        else:
+            paths.update(glob.glob(pattern, recursive=True))
+    return sorted(paths)
+
+
+def init_worker(demodulator_kwargs, block_seconds, cache_dir=None, cache_bytes=MAX_BYTES):
+    global _demodulator, _block_seconds, _cache
+    demod.init_pool_worker()
+    _demodulator = demod.Demodulator(**demodulator_kwargs)
+    _block_seconds = block_seconds
+    _cache = FeatureCache(cache_dir, cache_bytes) if cache_dir is not None else None
+
+
+def decode_recording(filepath):
+    """Pool task: decodes one recording, returns its JSON-serializable result (or error)"""
+    started = time.perf_counter()
+    try:
+        result = _demodulator.decode_file(filepath, _block_seconds, cache=_cache)
+    except Exception as err:
+        return {"file": filepath, "ok": False, "error": repr(err), "traceback": traceback.format_exc(),
+                "decode_time": time.perf_counter() - started}
+    record = {"file": filepath, "ok": True, "decode_time": time.perf_counter() - started}
+    record.update(result.to_dict())
+    return record
+
+
+def run_batch(filepaths, output, processes=None, block_seconds=None, cache_dir=None, cache_bytes=MAX_BYTES,
+              **demodulator_kwargs):
+    """
+    Decodes filepaths on a pool of processes (one per core by default) and writes a JSON line per recording
+    to the file object output. Features are cached in cache_dir if given, up to cache_bytes (see
+    feature_cache.FeatureCache). Returns the number of recordings that failed.
+    """
+    failed = 0
+    initargs = (demodulator_kwargs, block_seconds, cache_dir, cache_bytes)
+    with mp.Pool(processes, initializer=init_worker, initargs=initargs) as pool:
+        # one file per task, the recordings are large enough to keep the dispatch overhead negligible
+        for record in pool.imap_unordered(decode_recording, filepaths, chunksize=1):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            if record["ok"]:
+                print(("CRC OK   " if record["crc_ok"] else "CRC FAIL ") + record["file"] + " (" +
+                      str(round(record["decode_time"], 2)) + " s)", file=sys.stderr)
+            else:
+                failed += 1
+                print(Fore.YELLOW + "ERROR    " + record["file"] + ": " + record["error"], file=sys.stderr)
+                print(Fore.RESET, end="", file=sys.stderr)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PowerSupplay batch demodulator", parents=[demod.demodulator_parser()])
+    parser.add_argument("recordings",
+                        help="WAV files, directories or glob patterns",
+                        nargs="+")
+    parser.add_argument("--output",
+                        help="JSON lines file the results are written to (default: stdout)",
+                        default=None,
+                        dest="output",
+                        type=str)
+    parser.add_argument("--processes",
+                        help="Number of worker processes (default: one per core)",
+                        default=None,
+                        dest="processes",
+                        type=int)
+    args = parser.parse_args(argv)
+
+    filepaths = find_recordings(args.recordings)
+    if not filepaths:
+        parser.error("no recordings found")
+    print("Decoding " + str(len(filepaths)) + " recordings on " + str(args.processes or mp.cpu_count()) +
+          " processes", file=sys.stderr)
+
+    started = time.perf_counter()
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        failed = run_batch(filepaths, output, args.processes, args.block_seconds, args.cache_dir,
+                           int(args.cache_size * 2 ** 20), **demod.demodulator_kwargs(args))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print("Done in " + str(round(time.perf_counter() - started, 2)) + " s, " + str(failed) + " failed",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Calibration: sweeps grids of demodulator parameters over recordings of a known transmission from a new target
+machine and ranks every configuration by the frames that pass the CRC check and by its decision margin:
+$ python calibrate.py capture.wav --one-freqs 5000:6000:100 --zero-freqs 6000:7000:100 --time-intervals 0.05,0.1
+Grids are "start:stop:step" ranges (stop included) or comma separated lists. The dominant frequencies of the
+analysis windows don't depend on the tones, so every recording is filtered and analyzed once per window size,
+and all tone pairs are decoded from those features. Both stages run on a pool of processes. The tones recommended
+are the ones the decoder calibrated the best configuration to.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import time
+
+import numpy as np
+from colorama import Fore
+
+import demodulate_bfsk as demod
+
+# the grid is evaluated in this many tasks per process, which evens out their differing run times
+TASKS_PER_PROCESS = 4
+
+# configurations printed by default
+TOP_CONFIGS = 10
+
+
+def parse_grid(text, cast=float):
+    """Values of a grid given as "start:stop:step" (stop included) or as a comma separated list"""
+    if ":" in text:
+        start, stop, step = (float(value) for value in text.split(":"))
+        if step <= 0:
+            raise ValueError("The step of a grid must be positive, got " + str(step))
+        # rounded, so float steps don't yield intervals like 0.060000000000000005
+        return [cast(round(value, 9)) for value in np.arange(start, stop + step / 2, step)]
+    return [cast(value) for value in text.split(",")]
+
+
+def sweep_band(pairs):
+    """Bandpass (low, high) passing the guard band (see get_guard_band) of every (one_freq, zero_freq) pair"""
+    bands = np.array([demod.get_guard_band(one_freq, zero_freq) for one_freq, zero_freq in pairs])
+    return max(float(bands[:, 0].min()), 1.0), float(bands[:, 1].max())
+
+
+def decision_margin(features, one_freq, zero_freq, tolerance=demod.TONE_TOLERANCE):
+    """
+    Mean decision margin of the dominant frequencies of a frame: how much closer each window is to the tone it is
+    classified as than to the other one, relative to the tone spacing (1: right on a tone, 0: halfway between the
+    tones, or not classified at all)
+    """
+    features = np.asarray(features, dtype=float)
+    if not len(features):
+        return 0.0
+    margins = np.abs(np.abs(features - zero_freq) - np.abs(features - one_freq)) / abs(one_freq - zero_freq)
+    classified = demod.classify_freqs(features, one_freq, zero_freq, tolerance) >= 0
+    return float(np.mean(np.where(classified, np.minimum(margins, 1.0), 0.0)))
+
+
+def analyze_recording(task):
+    """
+    Pool task: dominant frequencies of the analysis windows of one recording, for one window size (see
+    Demodulator.analyze, the band of the sweep is part of demodulator_kwargs)
+    """
+    from scipy.io import wavfile
+
+    filepath, time_interval, demodulator_kwargs, block_seconds = task
+    fs, samples = wavfile.read(filepath, mmap=True)
+    demodulator = demod.Demodulator(time_interval=time_interval, **demodulator_kwargs)
+    return demodulator.analyze(samples, fs, block_seconds), fs, len(samples)
+
+
+def evaluate_pairs(task):
+    """
+    Pool task: decodes the features of every recording (for one window size) with each of a chunk of tone pairs,
+    returns the score of every configuration
+    """
+    time_interval, windows_per_symbol, recordings, pairs, demodulator_kwargs = task
+    scores = []
+    for one_freq, zero_freq in pairs:
+        demodulator = demod.Demodulator(one_freq, zero_freq, time_interval, windows_per_symbol=windows_per_symbol,
+                                        **demodulator_kwargs)
+        frames, crc_ok, margins, calibrated = 0, 0, [], []
+        for features, fs, n_samples in recordings:
+            result = demodulator.decode_features(features, fs, n_samples)
+            calibrated.append((result.one_freq, result.zero_freq))
+            frames += len(result.frames)
+            crc_ok += sum(frame.crc_ok for frame in result.frames)
+            for frame in result.frames:
+                start = int(round(frame.start / demodulator.hop_seconds(fs)))
+                end = int(round(frame.end / demodulator.hop_seconds(fs)))
+                margins.append(decision_margin(features[start:end], result.one_freq, result.zero_freq,
+                                               result.tolerances))
+
+        scores.append({"one_freq": one_freq, "zero_freq": zero_freq, "time_interval": time_interval,
+                       "windows_per_symbol": windows_per_symbol, "frames": frames, "crc_ok": crc_ok,
+                       "crc_rate": crc_ok / frames if frames else 0.0,
+                       "margin": float(np.mean(margins)) if margins else 0.0,
+                       "calibrated_one_freq": float(np.median([one for one, _ in calibrated])),
+                       "calibrated_zero_freq": float(np.median([zero for _, zero in calibrated]))})
+    return scores
+
+
+def run_sweep(filepaths, one_freqs, zero_freqs, time_intervals, symbol_seconds=1.0, processes=None,
+              block_seconds=None, verbose=1, **demodulator_kwargs):
+    """
+    Decodes the recordings at filepaths with every combination of one_freqs, zero_freqs and time_intervals (the
+    windows per symbol following from symbol_seconds) and further FFT engine demodulator_kwargs (e.g. overlap,
+    interpolation, fec_data_bits), on a pool of processes (one per core by default).
+    Returns the scores of all configurations, best first: most frames passing the CRC check, then the highest
+    share of such frames, then the largest decision margin (see decision_margin). The decoder calibrates the tones
+    (see demodulate_bfsk.calibrate_tones), so tone pairs close to the same signal often score the same; of those,
+    the one closest to its calibrated tones comes first.
+    """
+    pairs = [(one_freq, zero_freq) for one_freq in one_freqs for zero_freq in zero_freqs if one_freq != zero_freq]
+    if not pairs or not time_intervals:
+        raise ValueError("The sweep needs at least one tone pair and one time interval")
+    # every configuration analyzes the same band, so the features of one window size serve all tone pairs
+    demodulator_kwargs = dict(demodulator_kwargs, band=sweep_band(pairs))
+    processes = processes or mp.cpu_count()
+
+    with mp.Pool(processes, initializer=demod.init_pool_worker) as pool:
+        # one spectral pass per recording and window size
+        started = time.perf_counter()
+        tasks = [(filepath, time_interval, demodulator_kwargs, block_seconds)
+                 for time_interval in time_intervals for filepath in filepaths]
+        features = pool.map(analyze_recording, tasks, chunksize=1)
+        if verbose:
+            print("Analyzed " + str(len(filepaths)) + " recording(s) at " + str(len(time_intervals)) +
+                  " window size(s) in " + str(round(time.perf_counter() - started, 2)) + " s", file=sys.stderr)
+
+        # the tone pairs of every window size in chunks, each with the features of that window size
+        started = time.perf_counter()
+        chunk_len = max(1, int(np.ceil(len(pairs) * len(time_intervals) / (TASKS_PER_PROCESS * processes))))
+        tasks = []
+        for idx, time_interval in enumerate(time_intervals):
+            recordings = features[idx * len(filepaths):(idx + 1) * len(filepaths)]
+            windows_per_symbol = max(1, int(round(symbol_seconds / time_interval)))
+            for start in range(0, len(pairs), chunk_len):
+                tasks.append((time_interval, windows_per_symbol, recordings, pairs[start:start + chunk_len],
+                              demodulator_kwargs))
+        scores = [score for chunk in pool.imap_unordered(evaluate_pairs, tasks) for score in chunk]
+        if verbose:
+            print("Evaluated " + str(len(scores)) + " configurations in " +
+                  str(round(time.perf_counter() - started, 2)) + " s", file=sys.stderr)
+
+    return sorted(scores, key=lambda score: (-score["crc_ok"], -score["crc_rate"], -score["margin"],
+                                             calibration_offset(score), score["time_interval"]))
+
+
+def calibration_offset(score):
+    """How far the tones of a configuration are from the tones the decoder calibrated them to (Hz)"""
+    return abs(score["one_freq"] - score["calibrated_one_freq"]) + \
+        abs(score["zero_freq"] - score["calibrated_zero_freq"])
+
+
+def print_scores(scores, top=TOP_CONFIGS):
+    """Prints the best configurations of a sweep as a table, and the demodulator arguments of the best one"""
+    print(Fore.CYAN + "\n===BEST " + str(min(top, len(scores))) + " OF " + str(len(scores)) + " CONFIGURATIONS===")
+    print(Fore.RESET, end="")
+    print("rank  one_freq  zero_freq  interval  crc_ok/frames  margin  calibrated (one / zero)")
+    for rank, score in enumerate(scores[:top]):
+        print(str(rank + 1).rjust(4) + str(score["one_freq"]).rjust(10) + str(score["zero_freq"]).rjust(11) +
+              str(score["time_interval"]).rjust(10) +
+              (str(score["crc_ok"]) + "/" + str(score["frames"])).rjust(15) +
+              str(round(score["margin"], 3)).rjust(8) + "  " +
+              str(round(score["calibrated_one_freq"], 1)) + " / " + str(round(score["calibrated_zero_freq"], 1)))
+
+    best = scores[0]
+    if not best["crc_ok"]:
+        print(Fore.YELLOW + "\nNo configuration decoded a frame with a matching CRC")
+        print(Fore.RESET, end="")
+        return
+    # the calibrated tones are where the transmission actually is
+    print(Fore.GREEN + "\nBest: --one-freq " + str(int(round(best["calibrated_one_freq"]))) + " --zero-freq " +
+          str(int(round(best["calibrated_zero_freq"]))) + " --time-interval " + str(best["time_interval"]) +
+          " --windows-per-symbol " + str(best["windows_per_symbol"]))
+    print(Fore.RESET, end="")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PowerSupplay demodulator calibration")
+    parser.add_argument("recordings",
+                        help="WAV files of a known transmission from the target machine",
+                        nargs="+")
+    parser.add_argument("--one-freqs",
+                        help="Grid of target frequencies for binary 1s, start:stop:step or comma separated",
+                        default="5000:6000:100",
+                        dest="one_freqs",
+                        type=lambda grid: parse_grid(grid, int))
+    parser.add_argument("--zero-freqs",
+                        help="Grid of target frequencies for binary 0s, start:stop:step or comma separated",
+                        default="6000:7000:100",
+                        dest="zero_freqs",
+                        type=lambda grid: parse_grid(grid, int))
+    parser.add_argument("--time-intervals",
+                        help="Grid of analysis window lengths (s), start:stop:step or comma separated",
+                        default="0.1",
+                        dest="time_intervals",
+                        type=parse_grid)
+    parser.add_argument("--symbol-seconds",
+                        help="Duration of a transmitted symbol, sets the windows per symbol of every time interval",
+                        default=1.0,
+                        dest="symbol_seconds",
+                        type=float)
+    parser.add_argument("--overlap",
+                        help="Start an analysis window every time interval / OVERLAP seconds",
+                        default=1,
+                        dest="overlap",
+                        type=int)
+    parser.add_argument("--interpolation",
+                        help="Estimate the dominant frequency between FFT bins",
+                        default=None,
+                        choices=[interpolation for interpolation in demod.INTERPOLATIONS if interpolation is not None],
+                        dest="interpolation",
+                        type=str)
+    parser.add_argument("--fec",
+                        help="Hamming decode frames encoded with this many data bits per codeword (e.g. 4, 11, 26)",
+                        default=None,
+                        dest="fec",
+                        type=int)
+    parser.add_argument("--block-seconds",
+                        help="Filter / analyze the memory-mapped recordings in blocks of this many seconds",
+                        default=60.0,
+                        dest="block_seconds",
+                        type=float)
+    parser.add_argument("--processes",
+                        help="Number of worker processes (default: one per core)",
+                        default=None,
+                        dest="processes",
+                        type=int)
+    parser.add_argument("--top",
+                        help="Number of configurations to print",
+                        default=TOP_CONFIGS,
+                        dest="top",
+                        type=int)
+    parser.add_argument("--output",
+                        help="JSON lines file the scores of all configurations are written to, best first",
+                        default=None,
+                        dest="output",
+                        type=str)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    scores = run_sweep(args.recordings, args.one_freqs, args.zero_freqs, args.time_intervals, args.symbol_seconds,
+                       args.processes, args.block_seconds, overlap=args.overlap, interpolation=args.interpolation,
+                       fec_data_bits=args.fec)
+    print("Done in " + str(round(time.perf_counter() - started, 2)) + " s", file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            for score in scores:
+                output.write(json.dumps(score) + "\n")
+    print_scores(scores, args.top)
+    return 0 if scores[0]["crc_ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,247 +1,1157 @@
 import argparse
-import binascii
-import statistics
-from itertools import groupby
+import mmap
+import multiprocessing as mp
 
-import crc8
 import numpy as np
 from colorama import Fore
-from scipy import fftpack
-from scipy.io import wavfile
-
-from signal_analyzer import butter_bandpass_filter
-
-parser = argparse.ArgumentParser(description="PowerSupplay demodulator")
-parser.add_argument("--one-freq",
-                    help="Target frquency for binary 1s",
-                    default=5500,
-                    dest="one_freq",
-                    type=int),
-parser.add_argument("--zero-freq",
-                    help="Target frquency for binary 0s",
-                    default=6500,
-                    dest="zero_freq",
-                    type=int),
-parser.add_argument("--filepath",
-                    help="Filepath to the modulated recording",
-                    default="../02_modulation/audio_files/dell_test_100_300.wav",
-                    dest="filepath",
-                    type=str)
-parser.add_argument("--time-interval",
-                    help="Time intervals into which to slice sound file",
-                    default=0.1,
-                    dest="time_interval",
-                    type=float)
-
-args = parser.parse_args()
-
-# PARSE ARGS TO MATCH YOUR TARGETS
-ONE_FREQ = args.one_freq
-ZERO_FREQ = args.zero_freq
-FILEPATH = args.filepath
-TIME_INTERVAL = args.time_interval
-
-
-def get_dominant_freq(signal):
-    """
-    Find the dominant frequency within a signal represented by numpy array x.
-    x should not be too short, otherwise we can't determine the frequency with FFT!
-    """
-    x_fft = fftpack.fft(signal)
-    freqs = fftpack.fftfreq(len(signal)) * f_s
-    freqs = freqs[int(len(signal) / 10):int(len(signal) / 2)]
-    abs_x = np.abs(x_fft)
-    abs_x = abs_x[int(len(signal) / 10):int(len(signal) / 2)]
-    res = freqs[np.argmax(abs_x)]
-
-    # returns the dominant (loudest) frequency within x.
-    return int(res)
-
-
-def adjust_and_add_freqs(sub_xs):
-    """Adjust the parsed frequencies to be more accurate and returns the dominant frequencies as an array"""
-    global ZERO_FREQ, ONE_FREQ
-    res = []
-    # transform raw chunks into chunks of dominant frequencies
-    for idx, x in enumerate(sub_xs):
-        res.append(get_dominant_freq(x))
-
-    # fine-tune given frequencies with detected mean for 1s and 0s
-    zero_freqs = []
-    one_freqs = []
-    for freq in res:
-        if abs(freq - ZERO_FREQ) <= abs(freq - ONE_FREQ):
-            zero_freqs.append(freq)
-        else:
-            one_freqs.append(freq)
 
-    print("Updating 1 and 0 frequency targets according to gathered data...")
-    ZERO_FREQ = int(statistics.mean(zero_freqs))
-    ONE_FREQ = int(statistics.mean(one_freqs))
+import fec_decoder
+from instrumentation import Metrics, measure
+
+# SciPy (and the signal analyzer, which builds on it) is imported where it's used, so importing this module
+# stays cheap and a long-lived Demodulator pays for those imports once, on its first decode (see import_scipy)
+
+# number of windows transformed per real FFT call, bounds the memory used by the spectral pass
+FFT_BATCH = 4096
+
+# threads used by each real FFT call (-1: all cores), process pools set this to 1 in their workers
+FFT_WORKERS = -1
+
+# a tone only counts if it is this much louder than the loudest guard frequency (Goertzel engine)
+GUARD_FACTOR = 2.0
+
+# parallel decoding: every process gets a few segments of at least MIN_SEGMENT_SECONDS (several frames) each,
+# and each segment is filtered from SEGMENT_WARMUP_WINDOWS windows before its start on
+SEGMENTS_PER_PROCESS = 4
+MIN_SEGMENT_SECONDS = 60.0
+SEGMENT_WARMUP_WINDOWS = 2
+
+# soft decisions: per-window log-likelihood ratios are clipped to +-LLR_CLIP, so a single burst of interference
+# can't outweigh the other windows of its symbol
+LLR_CLIP = 20.0
+
+# soft decisions: a tone is present in a window if it is this much louder than the median guard frequency energy
+# of the recording (compared to a single window's guard frequencies, this holds up better in heavy noise)
+SOFT_PRESENCE_FACTOR = 4.0
+
+# sub-bin peak estimators of the FFT engine (None: the peak bin itself), see interpolate_peaks
+INTERPOLATIONS = (None, "parabolic", "log-parabolic")
+
+# dominant frequencies within this many Hz of a tone are classified as that tone, unless the tones are calibrated
+# (see calibrate_tones)
+TONE_TOLERANCE = 250
+
+# tone calibration: the tone clusters in the histogram of the dominant frequencies are re-estimated this many times
+CALIBRATION_ITERATIONS = 4
+
+# a calibrated tone claims the dominant frequencies within TOLERANCE_SPREADS times its spread, but at least within
+# MIN_TOLERANCE_BINS FFT bins and at most within TONE_TOLERANCE and half the tone spacing
+TOLERANCE_SPREADS = 4.0
+MIN_TOLERANCE_BINS = 2
+
+# tone calibration: histogram bins count only if they stand out this many standard deviations above the noise floor
+# (the windows without a tone land in the bins at random, so their counts are Poisson distributed)
+NOISE_FLOOR_SIGMAS = 5.0
+
+# interquartile range of a normal distribution, in standard deviations
+IQR_PER_SIGMA = 1.349
+
+# windows in the majority vote that corrects isolated misclassified windows (odd)
+SMOOTHING_WINDOWS = 3
+
+# analysis windows per transmitted symbol, i.e. 1 / (BFSK frequency * time interval)
+WINDOWS_PER_SYMBOL = 10
+
+PREAMBLE = [1, 0, 1, 0, 1, 0, 1, 0]
+
+# symbol timing recovery: the early-late gate moves the next symbol boundary by TIMING_GAIN times the timing error
+# measured on a symbol, and the symbol period by DRIFT_GAIN times it, so a drifting transmitter clock is tracked
+TIMING_GAIN = 0.5
+DRIFT_GAIN = 0.05
+
+# the symbol period (estimated from the preamble, then tracked) stays within this fraction of the nominal one,
+# the preamble search tries periods in steps of BAUD_SEARCH_STEP within that range
+MAX_BAUD_DEVIATION = 0.2
+BAUD_SEARCH_STEP = 0.05
+
+# once a frame is found, its symbol period is estimated from the preamble in finer steps (relative)
+BAUD_ESTIMATE_STEP = 0.01
+
+# minimum normalized correlation between the tone sequence and the preamble template for a frame to be found
+PREAMBLE_THRESHOLD = 0.8
+
+# matches this close to the best one of a cluster are ambiguous (the payload may continue the alternating
+# pattern), the earliest of them is taken as the frame start
+PREAMBLE_TOLERANCE = 0.05
+
+# a frame ends once at most ACTIVITY_THRESHOLD of the windows in SILENCE_SYMBOLS symbol periods carry a tone
+SILENCE_SYMBOLS = 2
+ACTIVITY_THRESHOLD = 0.5
+
+
+def frame_signal(signal, window_len, hop=None):
+    """
+    Returns a read-only (n_windows, window_len) view over signal, one row per analysis window.
+    No samples are copied; a trailing partial window is dropped.
+    """
+    if hop is None:
+        hop = window_len
+    if len(signal) < window_len:
+        return np.empty((0, window_len), dtype=signal.dtype)
+    n_windows = 1 + (len(signal) - window_len) // hop
+    stride = signal.strides[0]
+    return np.lib.stride_tricks.as_strided(signal, shape=(n_windows, window_len),
+                                           strides=(hop * stride, stride), writeable=False)
+
+
+def iter_filtered_blocks(signal, lowcut, highcut, fs, block_len, order=5, downconverter=None, metrics=None):
+    """
+    Bandpass filters signal (e.g. a memory-mapped recording) block by block, carrying the filter state
+    from one block to the next. Yields the filtered blocks, so only one of them is in memory at a time.
+    With a downconverter (see signal_analyzer.Downconverter), blocks are downconverted instead, its baseband lowpass
+    taking the place of the bandpass. Every block is measured as a call of the "bandpass" stage of metrics.
+    """
+    from signal_analyzer import BandpassFilter
+
+    band_filter = BandpassFilter(lowcut, highcut, fs, order=order) if downconverter is None else downconverter
+    for start in range(0, len(signal), block_len):
+        block = signal[start:start + block_len]
+        with measure(metrics, "bandpass", len(block)):
+            filtered = band_filter.process(block)
+        yield filtered
 
-    print("ZERO_FREQ --> " + str(ZERO_FREQ) + " Hz")
-    print("ONE_FREQ --> " + str(ONE_FREQ) + " Hz")
+
+def iter_frames(blocks, window_len, hop=None, metrics=None):
+    """
+    Regroups a stream of sample blocks into batches of complete (n_windows, window_len) analysis windows, starting
+    every hop samples (default: window_len); the samples of windows that aren't complete yet are carried over.
+    Every block is measured as a call of the "split" stage of metrics.
+    """
+    if hop is None:
+        hop = window_len
+    pending = np.empty(0)
+    for block in blocks:
+        with measure(metrics, "split", len(block)):
+            pending = np.concatenate([pending, block])
+            frames = frame_signal(pending, window_len, hop)
+            pending = pending[len(frames) * hop:]
+        if len(frames):
+            yield frames
+
+
+def interpolate_peaks(spectra, peaks, method="parabolic"):
+    """
+    Sub-bin peak positions: fits a parabola through every peak bin of spectra (magnitudes, one row per window)
+    and its two neighbours, on the magnitudes ("parabolic") or on their logarithm ("log-parabolic", exact for
+    Gaussian peaks and close for Hann windowed tones). Returns fractional bin indices.
+    """
+    rows = np.arange(len(spectra))
+    left = spectra[rows, np.maximum(peaks - 1, 0)]
+    center = spectra[rows, peaks]
+    right = spectra[rows, np.minimum(peaks + 1, spectra.shape[1] - 1)]
+    if method == "log-parabolic":
+        tiny = np.finfo(spectra.dtype).tiny
+        left, center, right = np.log(left + tiny), np.log(center + tiny), np.log(right + tiny)
+    elif method != "parabolic":
+        raise ValueError("Unknown interpolation: " + str(method))
+
+    curvature = left - 2 * center + right
+    offsets = np.divide(0.5 * (left - right), curvature, out=np.zeros(len(spectra), dtype=float),
+                        where=curvature < 0)
+    return peaks + np.clip(offsets, -0.5, 0.5)
+
+
+def get_dominant_freqs(frames, sampling_frequency, interpolation=None, zero_pad=1):
+    """
+    Finds the dominant frequency of every row in frames.
+    The frequency axis and band mask are computed once, the spectra are computed with one real FFT per
+    batch of FFT_BATCH windows (in single precision, which is plenty to find the loudest bin).
+    With interpolation ("parabolic" or "log-parabolic", see interpolate_peaks), windows are Hann windowed and the
+    peak is located between bins, so short windows still resolve the tones; zero_pad times longer FFTs (zero
+    padded) sample the spectrum more finely on top of that. Frequencies are then returned as floats.
+    """
+    from scipy import fft
+
+    window_len = frames.shape[1]
+    n_fft = window_len * zero_pad
+    band = slice(int(window_len / 10) * zero_pad, int(window_len / 2) * zero_pad)
+    taper = np.hanning(window_len).astype(np.float32) if interpolation is not None else None
+
+    res = np.empty(len(frames), dtype=int if interpolation is None else float)
+    for start in range(0, len(frames), FFT_BATCH):
+        batch = np.asarray(frames[start:start + FFT_BATCH], dtype=np.float32)
+        if taper is not None:
+            batch = batch * taper
+        abs_x = np.abs(fft.rfft(batch, n=n_fft, axis=1, workers=FFT_WORKERS)[:, band])
+        peaks = np.argmax(abs_x, axis=1)
+        if interpolation is not None:
+            peaks = interpolate_peaks(abs_x, peaks, interpolation)
+        res[start:start + FFT_BATCH] = (band.start + peaks) * sampling_frequency / n_fft
 
     return res
 
 
-def cut_preamble_and_return_bin_count(raw_data):
-    """Trims off the preamble and returns the respective symbol lengths following it"""
-    print(Fore.CYAN + "\n---PREAMBLE DETECTION---")
-    print(Fore.RESET, end="")
+def goertzel_energies(frames, sampling_frequency, target_freqs):
+    """
+    Energy at each of target_freqs for every row in frames, i.e. the single-bin DFT the Goertzel algorithm
+    computes. Instead of running the Goertzel recurrence sample by sample, every window is projected onto
+    the cosine and sine of each target frequency with one matrix product per batch of FFT_BATCH windows.
+    Returns an array of shape (n_windows, len(target_freqs)).
+    """
+    window_len = frames.shape[1]
+    phase = 2 * np.pi * np.outer(np.arange(window_len), target_freqs) / sampling_frequency
+    basis = np.concatenate([np.cos(phase), np.sin(phase)], axis=1).astype(np.float32)
+
+    res = np.empty((len(frames), len(target_freqs)))
+    for start in range(0, len(frames), FFT_BATCH):
+        batch = np.asarray(frames[start:start + FFT_BATCH], dtype=np.float32)
+        projection = (batch @ basis).astype(float)
+        res[start:start + FFT_BATCH] = projection[:, :len(target_freqs)] ** 2 + projection[:, len(target_freqs):] ** 2
+
+    return res
+
+
+def guard_freqs(*tone_freqs):
+    """
+    Frequencies no tone is sent at, which tell whether one of the tones stands out: halfway between neighbouring
+    tones and half a (smallest) tone spacing below and above the outermost ones
+    """
+    ordered = np.sort(tone_freqs)
+    spacing = np.diff(ordered).min()
+    return np.r_[ordered[0] - spacing / 2, (ordered[1:] + ordered[:-1]) / 2, ordered[-1] + spacing / 2].tolist()
+
+
+def goertzel_tone_ratios(frames, sampling_frequency, one_freq, zero_freq):
+    """
+    Per-window energy ratio (E1 - E0) / (E1 + E0) between the 1 and 0 tones, in [-1, 1].
+    Windows in which neither tone stands out against the guard frequencies (between and just outside
+    the tones) are set to 0.
+    """
+    return tone_ratios(goertzel_tone_energies(frames, sampling_frequency, one_freq, zero_freq))
+
+
+def tone_ratios(energies):
+    """Tone ratios (see goertzel_tone_ratios) of the per-window energies returned by goertzel_tone_energies"""
+    one_energy, zero_energy = energies[:, 0], energies[:, 1]
+
+    ratios = (one_energy - zero_energy) / np.maximum(one_energy + zero_energy, np.finfo(float).tiny)
+    present = np.maximum(one_energy, zero_energy) > GUARD_FACTOR * energies[:, 2:].max(axis=1)
+    ratios[~present] = 0
+    return ratios
+
 
-    # transform frequencies into bitstream
-    bin_data_from_raw = []
-    print("Attempting to parse detected frequencies to 1s and 0s...")
-    for bin_val in raw_data:
-        if ONE_FREQ - 250 <= bin_val <= ONE_FREQ + 250:
-            bin_data_from_raw.append(1)
-        elif ZERO_FREQ - 250 <= bin_val <= ZERO_FREQ + 250:
-            bin_data_from_raw.append(0)
+def goertzel_tone_energies(frames, sampling_frequency, one_freq, zero_freq):
+    """
+    Features of soft decisions: per-window energies at the 1 and 0 tones and at their guard frequencies (see
+    goertzel_tone_ratios), an array of shape (n_windows, 5). See tone_llrs.
+    """
+    return goertzel_energies(frames, sampling_frequency, [one_freq, zero_freq] + guard_freqs(one_freq, zero_freq))
+
+
+def tone_llrs(energies):
+    """
+    Soft decisions on goertzel_tone_energies: per-window log-likelihood ratio of a 1 over a 0, (E1 - E0) / N0 (the
+    square-law approximation for noncoherent FSK), N0 being the noise energy per bin, estimated as the median energy
+    at the guard frequencies of all the windows given (a whole recording, however it was split up for the analysis).
+    Returns the LLRs and whether a tone stood out against that noise level in each window.
+    """
+    one_energy, zero_energy = energies[:, 0], energies[:, 1]
+
+    noise = max(np.median(energies[:, 2:]), np.finfo(float).tiny) if len(energies) else 1.0
+    llrs = np.clip((one_energy - zero_energy) / noise, -LLR_CLIP, LLR_CLIP)
+    present = np.maximum(one_energy, zero_energy) > SOFT_PRESENCE_FACTOR * noise
+    return llrs, present
+
+
+def fdm_tone_ratios(frames, sampling_frequency, channels):
+    """
+    Tone ratios (see goertzel_tone_ratios) of several BFSK channels, given as (one_freq, zero_freq) pairs, at once.
+    Every batch of windows is transformed with a single real FFT, and all channels are read from the same
+    spectra, at the bins of their tones and guard frequencies. Returns an array of shape (n_windows, n_channels).
+    """
+    from scipy import fft
+
+    window_len = frames.shape[1]
+    freqs = []
+    for one_freq, zero_freq in channels:
+        freqs += [one_freq, zero_freq] + guard_freqs(one_freq, zero_freq)
+    bins = np.rint(np.array(freqs) * window_len / sampling_frequency).astype(int)
+
+    res = np.empty((len(frames), len(channels)))
+    for start in range(0, len(frames), FFT_BATCH):
+        batch = np.asarray(frames[start:start + FFT_BATCH], dtype=np.float32)
+        spectra = fft.rfft(batch, axis=1, workers=FFT_WORKERS)[:, bins]
+        energies = (spectra.real.astype(float) ** 2 + spectra.imag.astype(float) ** 2).reshape(len(batch), -1, 5)
+        one_energy, zero_energy = energies[:, :, 0], energies[:, :, 1]
+
+        ratios = (one_energy - zero_energy) / np.maximum(one_energy + zero_energy, np.finfo(float).tiny)
+        present = np.maximum(one_energy, zero_energy) > GUARD_FACTOR * energies[:, :, 2:].max(axis=2)
+        ratios[~present] = 0
+        res[start:start + FFT_BATCH] = ratios
+
+    return res
+
+
+def mfsk_symbols(frames, sampling_frequency, tones):
+    """
+    M-FSK detector: per-window index of the strongest of the tones, all measured in one pass (see goertzel_energies).
+    Windows in which no tone stands out against the guard frequencies (see guard_freqs) are set to -1.
+    """
+    energies = goertzel_energies(frames, sampling_frequency, list(tones) + guard_freqs(*tones))
+    tone_energies = energies[:, :len(tones)]
+
+    symbols = np.argmax(tone_energies, axis=1).astype(np.int8)
+    symbols[tone_energies.max(axis=1) <= GUARD_FACTOR * energies[:, len(tones):].max(axis=1)] = -1
+    return symbols
+
+
+def ratios_to_bits(ratios):
+    """Maps tone ratios to bits: 1, 0, or -1 for windows without a tone"""
+    return np.select([ratios > 0, ratios < 0], [1, 0], -1).astype(np.int8)
+
+
+def calibrate_tones(freqs, tones, resolution):
+    """
+    Robust M-cluster estimate of the tones (two for BFSK) in the dominant frequencies freqs of a recording, measured
+    with FFT bins resolution Hz apart. The frequencies within a tone spacing of the nominal tones are histogrammed
+    once (one bin per FFT bin) and thresholded at NOISE_FLOOR_SIGMAS above the noise floor, the median bin count, so
+    windows without a tone (scattered across the band) don't count, however many there are. Then every tone is moved
+    to the median of the histogram bins closest to it and its spread is estimated from their interquartile range; only
+    bins within TOLERANCE_SPREADS spreads of a tone (at first: half the tone spacing) count towards it. A tone no
+    window comes close to keeps its nominal frequency and the fixed TONE_TOLERANCE. Frequencies estimated between the
+    bins (floats, see get_dominant_freqs) finally refine every centre to their own median within its reach, which
+    the histogram would round to a bin.
+    Returns the tone centres, their spreads and the tolerance around each one (see classify_freqs), all in Hz.
+    """
+    tones = np.asarray(tones, dtype=float)
+    spacing = np.diff(np.sort(tones)).min()
+
+    # histogram with its bin centres on the FFT bins, above the noise floor (a Poisson count's deviation is the square
+    # root of its mean)
+    first = np.floor((tones.min() - spacing) / resolution)
+    bin_freqs = np.arange(first, np.ceil((tones.max() + spacing) / resolution) + 1) * resolution
+    idx = np.rint(np.asarray(freqs, dtype=float) / resolution - first)
+    counts = np.bincount(idx[(idx >= 0) & (idx < len(bin_freqs))].astype(int), minlength=len(bin_freqs))
+    noise_floor = np.median(counts)
+    counts = np.maximum(counts - (noise_floor + NOISE_FLOOR_SIGMAS * np.sqrt(max(noise_floor, 1))), 0)
+
+    centres, spreads = tones.copy(), np.full(len(tones), TONE_TOLERANCE / TOLERANCE_SPREADS)
+    reach = np.full(len(tones), spacing / 2)
+    for _ in range(CALIBRATION_ITERATIONS):
+        distance = np.abs(bin_freqs[:, None] - centres[None, :])
+        closest = np.argmin(distance, axis=1)[:, None] == np.arange(len(tones))
+        cumulative = np.cumsum(counts[:, None] * (closest & (distance <= reach)), axis=0)
+        total = cumulative[-1]
+        lower, median, upper = (bin_freqs[np.argmax(cumulative >= quantile * total, axis=0)]
+                                for quantile in (0.25, 0.5, 0.75))
+        centres = np.where(total > 0, median, centres)
+        spreads = np.where(total > 0, (upper - lower) / IQR_PER_SIGMA, spreads)
+        reach = np.where(total > 0, np.clip(TOLERANCE_SPREADS * spreads, MIN_TOLERANCE_BINS * resolution,
+                                            min(TONE_TOLERANCE, spacing / 2)), min(TONE_TOLERANCE, spacing / 2))
+
+    freqs = np.asarray(freqs)
+    if np.issubdtype(freqs.dtype, np.floating):
+        for tone in np.flatnonzero(total > 0):
+            near = freqs[np.abs(freqs - centres[tone]) <= reach[tone]]
+            if len(near):
+                centres[tone] = np.median(near)
+
+    # neighbouring tones never claim the same frequency
+    tolerances = np.minimum(reach, np.diff(np.sort(centres)).min() / 2)
+    return centres, spreads, tolerances
+
+
+def classify_freqs(raw_data, one_freq, zero_freq, tolerance=TONE_TOLERANCE):
+    """
+    Maps dominant frequencies to bits: 1, 0, or -1 if a frequency is close to neither tone. tolerance is either
+    the same for both tones or a (one, zero) pair, e.g. as calibrated by calibrate_tones.
+    """
+    raw_data = np.asarray(raw_data)
+    one_tolerance, zero_tolerance = np.broadcast_to(tolerance, 2)
+    bits = np.full(len(raw_data), -1, dtype=np.int8)
+    bits[np.abs(raw_data - zero_freq) <= zero_tolerance] = 0
+    bits[np.abs(raw_data - one_freq) <= one_tolerance] = 1
+    return bits
+
+
+def correct_errors(bits, verbose=0, n_symbols=2):
+    """
+    Replaces unclassified (-1) windows with the last classified value before them, dropping the ones at the
+    very start, then flips every window that disagrees with the majority of the SMOOTHING_WINDOWS around it.
+    bits may also hold M-FSK symbols (0 to n_symbols - 1).
+    """
+    valid = bits >= 0
+    if not valid.any():
+        return bits[:0]
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(bits)), 0))
+    filled = bits[last_valid][np.argmax(valid):]
+
+    half = SMOOTHING_WINDOWS // 2
+    corrected = filled.copy()
+    if len(filled) >= SMOOTHING_WINDOWS:
+        windows = np.lib.stride_tricks.sliding_window_view(filled, SMOOTHING_WINDOWS)
+        if n_symbols == 2:
+            corrected[half:len(filled) - half] = windows.sum(axis=1) > half
         else:
-            bin_data_from_raw.append(None)
-    print("Done!")
+            # votes for every symbol, a window only changes if one of them has the majority
+            votes = (windows[:, :, None] == np.arange(n_symbols)).sum(axis=1)
+            majority = votes.max(axis=1) > half
+            corrected[half:len(filled) - half][majority] = np.argmax(votes, axis=1)[majority]
 
-    # correct transmission errors
-    print("Detecting and correcting errors...")
-    loop_range = len(bin_data_from_raw)
-    for idx in range(0, loop_range):
-        if idx == loop_range:
+    changed = np.flatnonzero(corrected != filled)
+    if verbose:
+        print("Filled " + str(np.count_nonzero(~valid)) + " unclassified windows, corrected " +
+              str(len(changed)) + " windows")
+    if verbose > 1:
+        for idx in changed:
+            print("Position " + str(idx) + " - replaced a " + str(filled[idx]) + " with a " + str(corrected[idx]))
+    return corrected
+
+
+def find_frames(bits, windows_per_symbol=WINDOWS_PER_SYMBOL):
+    """
+    Matched filter search for every preamble in the per-window bits (see classify_freqs) of a recording.
+    The transmitter's symbol period may deviate from windows_per_symbol by up to MAX_BAUD_DEVIATION, so templates
+    stretched to every BAUD_SEARCH_STEP in that range are matched and the best match counts.
+    Returns the (start, end) window offsets of each frame, end being where the transmission falls silent.
+    """
+    from scipy.signal import correlate
+
+    signs = np.where(bits < 0, 0, 2 * bits - 1).astype(float)
+    preamble_len = len(PREAMBLE) * windows_per_symbol
+    n_starts = len(signs) - int(preamble_len * (1 - MAX_BAUD_DEVIATION)) + 1
+    if n_starts <= 0:
+        return []
+    corr = np.full(n_starts, -1.0)
+    for scale in 1 + np.arange(-MAX_BAUD_DEVIATION, MAX_BAUD_DEVIATION + BAUD_SEARCH_STEP / 2, BAUD_SEARCH_STEP):
+        # every window takes the symbol at its center
+        symbol_idx = ((np.arange(int(preamble_len * scale)) + 0.5) / (windows_per_symbol * scale)).astype(int)
+        template = 2.0 * np.array(PREAMBLE)[np.minimum(symbol_idx, len(PREAMBLE) - 1)] - 1
+        if len(template) <= len(signs):
+            match = correlate(signs, template, mode="valid") / len(template)
+            corr[:len(match)] = np.maximum(corr[:len(match)], match)
+
+    # fraction of tone windows in the SILENCE_SYMBOLS symbol periods starting at each window
+    silence_len = SILENCE_SYMBOLS * windows_per_symbol
+    activity = correlate((bits >= 0).astype(float), np.ones(silence_len), mode="valid") / silence_len
+
+    frames = []
+    candidates = np.flatnonzero(corr >= PREAMBLE_THRESHOLD)
+    while len(candidates):
+        cluster = corr[candidates[0]:candidates[0] + preamble_len]
+        start = candidates[0] + np.flatnonzero(cluster >= cluster.max() - PREAMBLE_TOLERANCE)[0]
+
+        # the frame ends with the first silent window of the first mostly silent stretch after the preamble
+        end = len(bits)
+        quiet = np.flatnonzero(activity[start + preamble_len:] <= ACTIVITY_THRESHOLD)
+        if len(quiet):
+            quiet_start = start + preamble_len + quiet[0]
+            end = quiet_start + np.flatnonzero(bits[quiet_start:quiet_start + silence_len] < 0)[0]
+
+        frames.append((int(start), int(end)))
+        candidates = candidates[candidates >= end]
+
+    return frames
+
+
+def estimate_symbol_timing(values, windows_per_symbol=WINDOWS_PER_SYMBOL):
+    """
+    Estimates the symbol period (in windows) and the start of the first symbol from the per-window symbols of a
+    frame, starting with its preamble: the preamble template is stretched to every BAUD_ESTIMATE_STEP within
+    MAX_BAUD_DEVIATION and shifted by up to half a symbol period, the best match gives period and start.
+    Matching whole templates rather than single transitions keeps the estimate stable in noise.
+    """
+    # the preamble alternates between symbols 1 and 0, anything else (M-FSK) counts as neither
+    signs = np.where(values == 1, 1.0, np.where(values == 0, -1.0, 0.0))
+
+    # every template is compared over the same number of windows, the part of the preamble even the shortest one
+    # covers; on a tie the period closest to the nominal one wins
+    compare_len = int(len(PREAMBLE) * windows_per_symbol * (1 - MAX_BAUD_DEVIATION))
+    steps = np.arange(-MAX_BAUD_DEVIATION, MAX_BAUD_DEVIATION + BAUD_ESTIMATE_STEP / 2, BAUD_ESTIMATE_STEP)
+    best, period, start = -np.inf, float(windows_per_symbol), 0
+    for scale in 1 + steps[np.argsort(np.abs(steps), kind="stable")]:
+        symbol_idx = ((np.arange(compare_len) + 0.5) / (windows_per_symbol * scale)).astype(int)
+        template = 2.0 * np.array(PREAMBLE)[symbol_idx] - 1
+        for shift in range(min(int(windows_per_symbol * scale / 2), len(signs) - compare_len) + 1):
+            score = signs[shift:shift + compare_len] @ template
+            if score > best:
+                best, period, start = score, windows_per_symbol * scale, shift
+    return float(period), float(start)
+
+
+def recover_symbols(values, windows_per_symbol=WINDOWS_PER_SYMBOL):
+    """
+    Symbol timing recovery for the per-window symbols (np.int8, not negative) of a frame, starting with its
+    preamble. The symbol period is estimated from the preamble (see estimate_symbol_timing), then an early-late gate
+    tracks the symbol boundaries across the frame: where the first quarter of a symbol agrees less with its
+    decision than the last quarter, the symbol started later than expected (and vice versa), so the next boundary
+    and the period are moved accordingly. Every symbol is decided by majority over its windows, a trailing partial
+    symbol counting if it covers at least half a period.
+    Returns the symbols and the (start, end) window range of every symbol.
+    """
+    period, start = estimate_symbol_timing(values, windows_per_symbol)
+    symbols, spans = [], []
+    while start + period / 2 <= len(values):
+        lo, hi = int(round(start)), min(int(round(start + period)), len(values))
+        if lo >= hi:
             break
-        if not (idx == 0 or idx == len(bin_data_from_raw) - 2):
-            if bin_data_from_raw[idx] == 0 and bin_data_from_raw[idx - 1] == 1 and bin_data_from_raw[idx + 1] == 1:
-                print("Position " + str(idx) + " - replaced a 0 with a 1")
-                bin_data_from_raw[idx] = 1
-            elif bin_data_from_raw[idx] == 1 and bin_data_from_raw[idx - 1] == 0 and bin_data_from_raw[idx + 1] == 0:
-                print("Position " + str(idx) + " - replaced a 1 with a 0")
-                bin_data_from_raw[idx] = 0
-            elif bin_data_from_raw[idx] is None:
-                try:
-                    bin_data_from_raw[idx] = int(
-                        round((bin_data_from_raw[idx - 1] + bin_data_from_raw[idx - 1]) / 2, 0))
-                    print("Position " + str(idx) + " - replaced a None value with " + str(bin_data_from_raw[idx]))
-                except TypeError:
-                    print("Position " + str(idx) + " - deleted irreparable None value")
-                    del bin_data_from_raw[idx]
-                    loop_range = len(bin_data_from_raw)
-    print("Done!")
-
-    print("Calculating symbol lengths...")
-    symbol_lengths = [sum(1 for _ in group) for _, group in groupby(bin_data_from_raw)]
-    print("Done!")
-    print("Accounting for rounding errors...")
-    for idx in range(0, len(symbol_lengths)):
-        symbol_lengths[idx] = round(symbol_lengths[idx], -1)
-        symbol_lengths[idx] = int(symbol_lengths[idx] / 10)
-    print("Done!")
-
-    # remove preamble and return payload+crc payload lengths
-    symbol_lengths = symbol_lengths[7:]
-    if symbol_lengths[0] == 0:
-        del symbol_lengths[0]
-    else:
-        symbol_lengths[0] -= 1
+        windows = values[lo:hi]
+        decision = np.argmax(np.bincount(windows))
+        symbols.append(decision)
+        spans.append((lo, hi))
 
-    return symbol_lengths
+        quarter = max(int(period / 4), 1)
+        error = (np.mean(windows[-quarter:] == decision) - np.mean(windows[:quarter] == decision)) * quarter
+        period = float(np.clip(period + DRIFT_GAIN * error, (1 - MAX_BAUD_DEVIATION) * windows_per_symbol,
+                               (1 + MAX_BAUD_DEVIATION) * windows_per_symbol))
+        start += period + TIMING_GAIN * error
 
+    return np.array(symbols, dtype=np.uint8), np.array(spans, dtype=int).reshape(-1, 2)
 
-def detect_payload_plus_crc(one_and_zero_lengths):
-    """Takes in the symbol lengths and returns a bitstream as a binary array"""
-    print(Fore.CYAN + "\n---PAYLOAD PROCESSING---")
-    print(Fore.RESET, end="")
-    payload_plus_crc = []
-    for idx, bits in enumerate(one_and_zero_lengths):
-        for i in range(0, bits):
-            if idx % 2:
-                payload_plus_crc.append(0)
-            else:
-                payload_plus_crc.append(1)
+
+def cut_preamble(bits, windows_per_symbol=WINDOWS_PER_SYMBOL, verbose=0, n_symbols=2):
+    """
+    Turns the per-window bits of a frame into symbols (np.uint8 0s and 1s, or 0 to n_symbols - 1 for M-FSK)
+    and trims off the preamble
+    """
+    if verbose:
+        print(Fore.CYAN + "\n---PREAMBLE DETECTION---")
+        print(Fore.RESET, end="")
+
+    # correct transmission errors
+    if verbose:
+        print("Detecting and correcting errors...")
+    bin_data_from_raw = correct_errors(bits, verbose, n_symbols)
+
+    if verbose:
+        print("Recovering symbol timing...")
+    symbols, spans = recover_symbols(bin_data_from_raw, windows_per_symbol)
+    if verbose and len(spans) > 1:
+        print("Symbol period: " + str(round(float(np.diff(spans[:, 0]).mean()), 2)) + " windows")
+
+    # remove preamble and return payload+crc symbols
+    return symbols[len(PREAMBLE):]
+
+
+def integrate_symbols(llrs, spans):
+    """Sums the per-window LLRs of a frame over the (start, end) window range of every symbol"""
+    cumulative = np.r_[0.0, np.cumsum(llrs)]
+    return cumulative[spans[:, 1]] - cumulative[spans[:, 0]]
+
+
+def cut_preamble_soft(llrs, windows_per_symbol=WINDOWS_PER_SYMBOL, verbose=0):
+    """
+    Soft counterpart of cut_preamble: recovers the symbol timing from the signs of the LLRs, decides every symbol on
+    its integrated LLR, then trims off the preamble
+    """
+    if verbose:
+        print(Fore.CYAN + "\n---PREAMBLE DETECTION---")
+        print(Fore.RESET, end="")
+        print("Integrating window LLRs per symbol...")
+    _, spans = recover_symbols((llrs > 0).astype(np.int8), windows_per_symbol)
+    symbol_llrs = integrate_symbols(llrs, spans)
+    if verbose:
+        print("Weakest symbol decision: |LLR| = " + str(round(float(np.abs(symbol_llrs).min()), 2))
+              if len(symbol_llrs) else "No symbols")
+
+    # remove preamble and return payload+crc symbols
+    return (symbol_llrs > 0).astype(np.uint8)[len(PREAMBLE):]
+
+
+def detect_payload_plus_crc(symbols, verbose=0, bits_per_symbol=1, fec_data_bits=None):
+    """
+    Expands the symbols following the preamble to bits_per_symbol bits each (MSB first), corrects them with the
+    Hamming code of fec_data_bits data bits per codeword if given (see fec_decoder.py) and prunes them to whole bytes,
+    returns them as an np.uint8 bit array
+    """
+    if verbose:
+        print(Fore.CYAN + "\n---PAYLOAD PROCESSING---")
+        print(Fore.RESET, end="")
+
+    symbols = np.asarray(symbols, dtype=np.uint8)
+    bits = ((symbols[:, None] >> np.arange(bits_per_symbol - 1, -1, -1)) & 1).astype(np.uint8).ravel()
+    if fec_data_bits is not None:
+        bits = fec_decoder.decode(bits, fec_data_bits, verbose)
 
     # payload pruning (to multiples of 8)
-    while len(payload_plus_crc) % 8:
-        del payload_plus_crc[-1]
+    return bits[:len(bits) - len(bits) % 8]
 
-    print("Done!")
-    return payload_plus_crc
 
+def make_crc8_table(poly=0x07):
+    """Lookup table of the CRC-8 of every byte value, for the polynomial poly (MSB first, no reflection)"""
+    table = np.empty(256, dtype=np.uint8)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[byte] = crc
+    return table
 
-def crc_check(payload_plus_crc):
-    """Verify CRC"""
-    print(Fore.CYAN + "\n---CRC CHECK---")
-    print(Fore.RESET, end="")
 
-    # determine data, cut last 8 bits
-    payload_int = 0
-    for bit in payload_plus_crc[:len(payload_plus_crc) - 8]:
-        payload_int = (payload_int << 1) | bit
+# CRC-8/SMBUS (polynomial 0x07, initial value 0), as computed by the modulator
+CRC8_TABLE = make_crc8_table().tolist()
 
-    # calculate crc on last 8 bits in payload_plus_crc
-    crc_int = 0
-    for bit in payload_plus_crc[-8:]:
-        crc_int = (crc_int << 1) | bit
 
-    crc = crc8.crc8()
-    crc.update(bin(payload_int).encode("UTF-8"))
+def crc8(data, crc=0):
+    """CRC-8 of the bytes data, one table lookup per byte; crc continues a previous calculation"""
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
 
-    print("Received CRC: " + "{0:b}".format(crc_int))
-    print("Calculated CRC: " + "{0:b}".format(int(crc.hexdigest())))
 
-    if crc_int == crc.hexdigest():
-        return True
-    else:
+def crc_check(payload_plus_crc, verbose=0):
+    """Verify CRC: the last byte of payload_plus_crc (bit array, see detect_payload_plus_crc) must match the rest"""
+    if verbose:
+        print(Fore.CYAN + "\n---CRC CHECK---")
+        print(Fore.RESET, end="")
+    if len(payload_plus_crc) < 8:
         return False
 
+    packed = np.packbits(payload_plus_crc).tobytes()
+    received_crc, calculated_crc = packed[-1], crc8(packed[:-1])
 
-# taken from https://stackoverflow.com/questions/7396849/convert-binary-to-ascii-and-vice-versa
-def int2bytes(i):
-    hex_string = '%x' % i
-    n = len(hex_string)
-    return binascii.unhexlify(hex_string.zfill(n + (n & 1)))
+    if verbose:
+        print("Received CRC: " + "{0:08b}".format(received_crc))
+        print("Calculated CRC: " + "{0:08b}".format(calculated_crc))
 
+    return received_crc == calculated_crc
 
-# taken from https://stackoverflow.com/questions/7396849/convert-binary-to-ascii-and-vice-versa
-def text_from_bits(bits, encoding='utf-8', errors='surrogatepass'):
-    n = int(bits, 2)
-    return int2bytes(n).decode(encoding, errors)
 
+def text_from_bits(bits, encoding='utf-8', errors='strict'):
+    """Decodes a bit array (MSB first, a multiple of 8 long) to text"""
+    return np.packbits(np.asarray(bits, dtype=np.uint8)).tobytes().decode(encoding, errors)
 
-def process_signal(sampling_frequency, x_signal):
-    """Main function for processing the signal, sub functions called within"""
-    print(Fore.CYAN + "\n---PREPARATION---")
-    print(Fore.RESET, end="")
-    # splitting raw signal into chunks of length TIME_INTERVAL
-    split = []
-    i = 0
-    while i < len(x_signal):
-        i += int(sampling_frequency * TIME_INTERVAL)
-        split.append(i)
 
-    x_signal_split = np.array_split(x_signal, split)
+def get_guard_band(*tone_freqs):
+    """
+    Returns the (low, high) cutoffs of the bandpass around all tones (the 1 and 0 tones for BFSK), one (smallest)
+    tone spacing wide on each side
+    """
+    spacing = np.diff(np.sort(tone_freqs)).min()
+    return min(tone_freqs) - spacing, max(tone_freqs) + spacing
+
+
+class Frame(object):
+    """
+    A decoded frame: where it is in the recording (in seconds), its bits and whether the CRC matched.
+    The first byte of a packet (see 02_modulation/framing.py) is its sequence number, which isn't part of the payload.
+    """
+
+    def __init__(self, start, end, payload_plus_crc, crc_ok, channel=None, packet=False):
+        self.start = start
+        self.end = end
+        self.payload_plus_crc = payload_plus_crc
+        self.crc_ok = crc_ok
+        # index of the FDM channel the frame was received on, None for single channel recordings
+        self.channel = channel
+        self.packet = packet
+
+    @property
+    def seq(self):
+        """Sequence number (modulo 256) of a packet, None if the frame isn't one or too short to hold it"""
+        if not self.packet or len(self.payload_plus_crc) < 16:
+            return None
+        return int(np.packbits(self.payload_plus_crc[:8])[0])
+
+    @property
+    def payload_bits(self):
+        """Payload bits (np.uint8 array), without the CRC (and the sequence number of a packet)"""
+        start = 8 if self.packet else 0
+        return self.payload_plus_crc[start:max(len(self.payload_plus_crc) - 8, start)]
+
+    @property
+    def payload_bytes(self):
+        return np.packbits(self.payload_bits).tobytes()
+
+    @property
+    def payload(self):
+        """Payload bits as a string of 1s and 0s"""
+        return "".join("01"[bit] for bit in self.payload_bits)
+
+    @property
+    def text(self):
+        """Payload decoded as UTF-8 text, None if it isn't valid text"""
+        try:
+            return self.payload_bytes.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+    def to_dict(self):
+        res = {"start": self.start, "end": self.end, "payload": self.payload, "crc_ok": self.crc_ok,
+               "text": self.text}
+        if self.channel is not None:
+            res["channel"] = self.channel
+        if self.packet:
+            res["seq"] = self.seq
+        return res
+
+
+class DecodeResult(object):
+    """Everything Demodulator.decode found in a recording, plus the calibrated tones and stage timings"""
+
+    def __init__(self, sampling_frequency, n_samples, one_freq, zero_freq, frames, timings, tolerances=None,
+                 metrics=None):
+        self.sampling_frequency = sampling_frequency
+        self.n_samples = n_samples
+        self.one_freq = one_freq
+        self.zero_freq = zero_freq
+        self.frames = frames
+        self.timings = timings
+        # (one, zero) classification tolerances of the calibrated tones (FFT engine only), in Hz
+        self.tolerances = tolerances
+        # per-stage wall time, samples and peak memory (see instrumentation.Metrics), timings summarizes them
+        self.metrics = metrics
+
+    @property
+    def crc_ok(self):
+        """True if at least one frame was found and all of them passed the CRC check"""
+        return bool(self.frames) and all(frame.crc_ok for frame in self.frames)
+
+    def to_dict(self):
+        res = {"sampling_frequency": self.sampling_frequency, "n_samples": self.n_samples,
+               "one_freq": self.one_freq, "zero_freq": self.zero_freq, "crc_ok": self.crc_ok,
+               "frames": [frame.to_dict() for frame in self.frames], "timings": self.timings}
+        if self.tolerances is not None:
+            res["tolerances"] = list(self.tolerances)
+        if self.metrics is not None:
+            res["metrics"] = self.metrics.to_dict()
+        return res
+
+
+class Demodulator(object):
+    """
+    BFSK (M-FSK, FDM) demodulator holding its own configuration, so one instance can be kept around and reused:
+    >>> demodulator = Demodulator(one_freq=5500, zero_freq=6500)
+    >>> result = demodulator.decode(samples, fs)
+    >>> result.frames[0].crc_ok
+    decode() doesn't modify the demodulator (the calibrated tones are part of the result), so an instance can
+    also be shared between threads. verbose=1 prints the progress of every stage, verbose=2 also every
+    corrected window.
+    """
+
+    def __init__(self, one_freq=5500, zero_freq=6500, time_interval=0.1, engine="fft", filter_order=5,
+                 windows_per_symbol=WINDOWS_PER_SYMBOL, verbose=0, tones=None, channels=None, soft=False,
+                 fec_data_bits=None, interpolation=None, zero_pad=1, overlap=1, decimation=None, packets=False,
+                 band=None):
+        if engine not in ("fft", "goertzel"):
+            raise ValueError("Unknown engine: " + str(engine))
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError("Unknown interpolation: " + str(interpolation))
+        if zero_pad < 1:
+            raise ValueError("zero_pad must be at least 1, got " + str(zero_pad))
+        if overlap < 1:
+            raise ValueError("overlap must be at least 1, got " + str(overlap))
+        if decimation is not None and decimation < 1:
+            raise ValueError("decimation must be at least 1, got " + str(decimation))
+        if tones is not None and channels is not None:
+            raise ValueError("M-FSK tones and FDM channels can't be combined")
+        if soft and (tones is not None or channels is not None):
+            raise ValueError("Soft decisions are only supported for single channel BFSK")
+        if channels is not None:
+            channels = [tuple(channel) for channel in channels]
+            one_freq, zero_freq = channels[0]
+        # (one_freq, zero_freq) of simultaneous BFSK channels (see generate_fdm), all read from the same FFT frames
+        # (see fdm_tone_ratios) and decoded separately
+        self.channels = channels
+        # BFSK bits are decided per symbol on integrated log-likelihood ratios (see tone_llrs)
+        self.soft = soft
+        # data bits per Hamming codeword of FEC encoded frames (see fec_decoder.py)
+        self.fec_data_bits = fec_data_bits
+        if tones is not None:
+            if len(tones) < 2 or len(tones) & (len(tones) - 1):
+                raise ValueError("The number of tones must be a power of two, got " + str(len(tones)))
+            tones = list(tones)
+            one_freq, zero_freq = tones[1], tones[0]
+        # M-FSK tone table (M a power of two): the preamble alternates between tones[1] and tones[0], every
+        # following symbol carries log2(M) bits (see mfsk_symbols)
+        self.tones = tones
+        self.one_freq = one_freq
+        self.zero_freq = zero_freq
+        self.time_interval = time_interval
+        self.engine = engine
+        self.filter_order = filter_order
+        # peak interpolation and zero padding of the FFT engine, which resolve the tones between bins with short
+        # time intervals (see get_dominant_freqs)
+        self.interpolation = interpolation
+        self.zero_pad = zero_pad
+        self.windows_per_symbol = windows_per_symbol
+        # a window starts every time_interval / overlap seconds, frame offsets are counted in these hops
+        self.overlap = overlap
+        # the band is mixed down and decimated by this factor before the analysis (see signal_analyzer.Downconverter)
+        self.decimation = decimation
+        # frames are packets whose first byte is a sequence number (see Frame)
+        self.packets = packets
+        # (low, high) band analyzed instead of the guard band of the tones (see analysis_band)
+        self.band = tuple(band) if band is not None else None
+        self.verbose = verbose
+
+    @property
+    def tone_freqs(self):
+        """All tone frequencies: the M-FSK tone table, the tones of every channel or the 1 and 0 tones"""
+        if self.channels is not None:
+            return [freq for channel in self.channels for freq in channel]
+        return self.tones if self.tones is not None else [self.one_freq, self.zero_freq]
+
+    @property
+    def analysis_band(self):
+        """(low, high) cutoffs of the band analyzed: band if given, otherwise the guard band of the tones"""
+        return self.band if self.band is not None else get_guard_band(*self.tone_freqs)
+
+    @property
+    def hop_interval(self):
+        """Time between the starts of two analysis windows"""
+        return self.time_interval / self.overlap
+
+    @property
+    def symbol_windows(self):
+        """Analysis windows starting within one symbol period"""
+        return self.windows_per_symbol * self.overlap
+
+    def front_end(self, fs):
+        """Downconverter for a recording sampled at fs (see signal_analyzer.Downconverter), None without decimation"""
+        from signal_analyzer import Downconverter
+
+        if self.decimation is None:
+            return None
+        return Downconverter(*self.analysis_band, fs, self.decimation, order=self.filter_order)
+
+    def window_hop(self, fs):
+        """Length of an analysis window and the hop between two of them, in samples at the analysis rate fs"""
+        window_len = int(fs * self.time_interval)
+        return window_len, max(window_len // self.overlap, 1)
+
+    def hop_seconds(self, fs):
+        """
+        Exact time between the starts of two analysis windows of a recording sampled at fs: the hop is a whole number
+        of samples at the analysis rate, so it can differ from hop_interval
+        """
+        analysis_rate = fs / (self.decimation or 1)
+        return self.window_hop(analysis_rate)[1] / analysis_rate
+
+    def frequency_resolution(self, fs):
+        """Spacing of the FFT engine's frequency bins (Hz), for a recording sampled at fs"""
+        analysis_rate = fs / (self.decimation or 1)
+        return analysis_rate / (self.window_hop(analysis_rate)[0] * self.zero_pad)
+
+    @property
+    def bits_per_symbol(self):
+        return len(self.tones).bit_length() - 1 if self.tones is not None else 1
+
+    def _log(self, message, color=None):
+        if self.verbose:
+            if color is None:
+                print(message)
+            else:
+                print(color + message)
+                print(Fore.RESET, end="")
+
+    def analysis_params(self):
+        """
+        Everything the features computed by analyze depend on (besides the recording), e.g. as a cache key. The
+        dominant frequencies of the FFT engine only depend on the band analyzed, not on the tones in it.
+        """
+        if self.soft:
+            mode = "soft"
+        elif self.channels is not None:
+            mode = "fdm"
+        elif self.tones is not None:
+            mode = "mfsk"
+        else:
+            mode = self.engine
+        params = {"mode": mode, "band": [float(freq) for freq in self.analysis_band],
+                  "time_interval": self.time_interval, "overlap": self.overlap, "filter_order": self.filter_order,
+                  "decimation": self.decimation, "interpolation": self.interpolation, "zero_pad": self.zero_pad}
+        if mode != "fft":
+            params["tone_freqs"] = [float(freq) for freq in self.tone_freqs]
+        return params
+
+    def decode_file(self, filepath, block_seconds=None, processes=None, cache=None, metrics=None):
+        """
+        Reads and decodes a WAV file. It is memory-mapped if block_seconds or processes is given, see decode.
+        With a cache (see feature_cache.FeatureCache), the features of the recording are looked up there first and
+        stored there after the spectral pass; on a hit, the recording isn't even read.
+        """
+        from scipy.io import wavfile
+
+        metrics = Metrics() if metrics is None else metrics
+        import_scipy()
+        key = None
+        if cache is not None:
+            with metrics.stage("cache"):
+                key = cache.key(filepath, self.analysis_params())
+                cached = cache.get(key)
+            if cached is not None:
+                self._log("Features of " + filepath + " found in the cache")
+                return self.decode_features(cached["features"], int(cached["sampling_frequency"]),
+                                            int(cached["n_samples"]), metrics)
+
+        self._log("Reading " + filepath)
+        with metrics.stage("read") as stage:
+            fs, samples = wavfile.read(filepath, mmap=block_seconds is not None or processes is not None)
+            stage.samples += len(samples)
+        if key is None:
+            return self.decode(samples, fs, block_seconds, processes, metrics)
+
+        features = self.extract_features(samples, fs, block_seconds, processes, metrics)
+        with metrics.stage("cache"):
+            cache.put(key, features=features, sampling_frequency=fs, n_samples=len(samples))
+        return self.decode_features(features, fs, len(samples), metrics)
+
+    def analyze(self, samples, fs, block_seconds=None, metrics=None, offset=0):
+        """
+        Filters a raw recording and returns one feature per analysis window: its dominant frequency (FFT engine)
+        or its tone ratio (Goertzel engine, see goertzel_tone_ratios), or the index of its M-FSK tone (see
+        mfsk_symbols).
+        With block_seconds, samples (e.g. a memory-mapped recording) are filtered and analyzed block by block,
+        so memory use doesn't grow with the recording length.
+        With decimation, the recording is downconverted instead of bandpass filtered and analyzed at shifted tone
+        frequencies; dominant frequencies are shifted back. offset is the first sample of samples in the whole
+        recording, the downconverter's oscillators start there.
+        The bandpass, split and spectral stages are measured in metrics if given (see instrumentation.Metrics).
+        """
+        downconverter = self.front_end(fs)
+        shift = 0
+        if downconverter is not None:
+            downconverter.reset(offset)
+            fs, shift = downconverter.fs, downconverter.shift
+        window_len, hop = self.window_hop(fs)
+        band = [freq + shift for freq in self.analysis_band]
+        if block_seconds is None:
+            from signal_analyzer import butter_bandpass_filter
+
+            # "guard bands" (the downconverter's baseband lowpass, with decimation), then framing filtered signal into
+            # windows of length time_interval (strided view)
+            with measure(metrics, "bandpass", len(samples)):
+                if downconverter is None:
+                    filtered = butter_bandpass_filter(samples, *band, fs, order=self.filter_order)
+                else:
+                    filtered = downconverter.process(samples)
+            with measure(metrics, "split", len(filtered)):
+                frames = [frame_signal(filtered, window_len, hop)]
+        else:
+            # blocks are a whole number of windows long, so without overlap no samples are carried between them
+            block_len = window_len * max(1, int(round(block_seconds / self.time_interval))) * (self.decimation or 1)
+            blocks = iter_filtered_blocks(samples, *band, fs, block_len, self.filter_order, downconverter, metrics)
+            frames = iter_frames(blocks, window_len, hop, metrics)
+
+        features = []
+        for batch in frames:
+            with measure(metrics, "spectral", len(batch), "windows"):
+                features.append(self._detect(batch, fs, shift))
+        return np.concatenate(features) if features else np.empty(0)
+
+    def _detect(self, frames, fs, shift=0):
+        """Features of a batch of analysis windows sampled at fs, the tones shifted by shift (see analyze)"""
+        one_freq, zero_freq = self.one_freq + shift, self.zero_freq + shift
+        if self.soft:
+            return goertzel_tone_energies(frames, fs, one_freq, zero_freq)
+        if self.channels is not None:
+            return fdm_tone_ratios(frames, fs, [(one + shift, zero + shift) for one, zero in self.channels])
+        if self.tones is not None:
+            return mfsk_symbols(frames, fs, [tone + shift for tone in self.tones])
+        if self.engine == "goertzel":
+            return goertzel_tone_ratios(frames, fs, one_freq, zero_freq)
+        return get_dominant_freqs(frames, fs, self.interpolation, self.zero_pad) - shift
+
+    def analyze_parallel(self, samples, fs, processes=None, block_seconds=None, metrics=None):
+        """
+        Same as analyze, with the recording split into segments that are filtered and analyzed on a pool of
+        processes (one per core by default). Each segment starts SEGMENT_WARMUP_WINDOWS windows early so the
+        filter has settled by the time its own windows begin, the features of these windows are dropped again.
+        A memory-mapped recording (as returned by wavfile.read with mmap=True) is mapped again by every worker
+        instead of being copied to it.
+        With metrics, the stages measured in the workers are added up (see instrumentation.Metrics.merge), and the
+        wall time of the whole pool is measured as the "parallel" stage.
+        """
+        # windows in samples at the analysis rate, segments in samples of the recording
+        factor = self.decimation or 1
+        window_len, hop = self.window_hop(fs / factor)
+        n_samples = -(-len(samples) // factor)
+        n_windows = 1 + (n_samples - window_len) // hop if n_samples >= window_len else 0
+        processes = processes or mp.cpu_count()
+
+        # a few segments per process even out their differing run times, but each one spans several frames
+        segment_windows = max(int(np.ceil(n_windows / (SEGMENTS_PER_PROCESS * processes))),
+                              int(MIN_SEGMENT_SECONDS / self.hop_interval))
+        if isinstance(samples, np.memmap) and isinstance(samples.base, mmap.mmap):
+            source = (samples.filename, samples.dtype, samples.offset, samples.shape)
+        else:
+            source = None
+
+        trace_memory = None if metrics is None else metrics.trace_memory
+        tasks = []
+        for start in range(0, n_windows, segment_windows):
+            stop = min(start + segment_windows, n_windows)
+            warmup = min(start, SEGMENT_WARMUP_WINDOWS * self.overlap)
+            span = ((start - warmup) * hop * factor, ((stop - 1) * hop + window_len) * factor)
+            segment = source if source is not None else samples[span[0]:span[1]]
+            tasks.append((self, segment, span if source is not None else None, span[0], fs, warmup, block_seconds,
+                          trace_memory))
+        self._log("Analyzing " + str(len(tasks)) + " segments of up to " +
+                  str(round(segment_windows * self.hop_interval, 2)) + " s on " + str(processes) + " processes")
+
+        with measure(metrics, "parallel", len(samples)):
+            with mp.Pool(processes, initializer=init_pool_worker) as pool:
+                results = pool.map(_analyze_segment, tasks, chunksize=1)
+        features = []
+        for segment_features, segment_metrics in results:
+            features.append(segment_features)
+            if metrics is not None:
+                metrics.merge(segment_metrics)
+        return np.concatenate(features) if features else np.empty(0)
+
+    def decode(self, samples, fs, block_seconds=None, processes=None, metrics=None):
+        """
+        Decodes every frame in a raw (unfiltered) recording.
+        With block_seconds, the recording is filtered and analyzed block by block (see analyze). With processes,
+        it is split into segments analyzed in parallel (see analyze_parallel, processes=0 uses every core).
+        Frames are searched for in the features of the whole recording, so frames spanning segments are found
+        just the same.
+        Every stage is measured in metrics (a new instrumentation.Metrics if None), which the result holds.
+        """
+        metrics = Metrics() if metrics is None else metrics
+        import_scipy()
+        features = self.extract_features(samples, fs, block_seconds, processes, metrics)
+        return self.decode_features(features, fs, len(samples), metrics)
 
-    # cut remainder if too small for useful analysis
-    if len(x_signal_split[-1]) < sampling_frequency * 100:
-        del x_signal_split[-1]
+    def extract_features(self, samples, fs, block_seconds=None, processes=None, metrics=None):
+        """Filtering and spectral analysis of decode: analyze, or analyze_parallel if processes is given"""
+        self._log("\n---PREPARATION---", Fore.CYAN)
+        factor = self.decimation or 1
+        window_len, hop = self.window_hop(fs / factor)
+        self._log("Splitting x into " + str(max(0, 1 + (len(samples) // factor - window_len) // hop)) +
+                  " subarrays, lasting for " + str(self.time_interval) + " s each")
 
-    print("Splitting x into " + str(len(x_signal_split)) + " subarrays, lasting for " +
-          str(TIME_INTERVAL) + " s each")
+        if processes is None:
+            return self.analyze(samples, fs, block_seconds, metrics)
+        return self.analyze_parallel(samples, fs, processes, block_seconds, metrics)
 
-    # data processing
-    frequency_list = adjust_and_add_freqs(x_signal_split)
-    ones_and_zeroes_count = cut_preamble_and_return_bin_count(frequency_list)
-    payload_plus_crc = detect_payload_plus_crc(ones_and_zeroes_count)
+    def decode_features(self, features, fs, n_samples, metrics=None):
+        """
+        Decision stages of decode (calibration, frame search, preamble, payload and CRC), on the features of a
+        recording of n_samples samples (see analyze), e.g. cached ones. They are measured in metrics (a new
+        instrumentation.Metrics if None), which may already hold the stages before.
+        """
+        metrics = Metrics() if metrics is None else metrics
+        import_scipy()
+        with metrics.stage("calibration", len(features), "windows"):
+            one_freq, zero_freq, tolerances, streams = self._decide_windows(features, fs)
 
-    # return a printable payload string
-    payload_string = ""
-    payload = payload_plus_crc[1:len(payload_plus_crc) - 8]
-    for bit in payload:
-        payload_string += str(bit)
+        self._log("\n---FRAME SEARCH---", Fore.CYAN)
+        with metrics.stage("frame_search", len(features) * len(streams), "windows"):
+            frame_bounds = [(stream, start, end) for stream, (_, bits, _) in enumerate(streams)
+                            for start, end in find_frames(bits, self.symbol_windows)]
+        self._log("Found " + str(len(frame_bounds)) + " frame(s)")
+
+        # every frame is decoded on its own
+        decoded = []
+        for stream, start, end in frame_bounds:
+            channel, bits, symbols = streams[stream]
+            frame = self.decode_frame((bits if symbols is None else symbols)[start:end], fs, start, end, metrics)
+            frame.channel = channel
+            decoded.append(frame)
+        decoded.sort(key=lambda frame: frame.start)
+
+        return DecodeResult(fs, n_samples, one_freq, zero_freq, decoded, metrics.timings(), tolerances, metrics)
+
+    def _decide_windows(self, features, fs):
+        """
+        Per-window bits (and symbols, for M-FSK) of every channel of a recording sampled at fs, as (channel, bits,
+        symbols) streams, with the (calibrated) one and zero tones and their tolerances
+        """
+        one_freq, zero_freq, tolerances = self.one_freq, self.zero_freq, None
+        if self.soft:
+            # the frame search runs on hard decisions, the frames themselves are decoded from the LLRs
+            llrs, present = tone_llrs(features)
+            streams = [(None, np.where(present, llrs > 0, -1).astype(np.int8), llrs)]
+        elif self.channels is not None:
+            streams = [(channel, ratios_to_bits(features[:, channel]), None) for channel in range(len(self.channels))]
+        elif self.tones is not None:
+            # M-FSK symbols; the preamble alternates between symbols 1 and 0, the frame search only needs those
+            symbols = features.astype(np.int8)
+            streams = [(None, np.where(symbols < 0, -1, symbols == 1).astype(np.int8), symbols)]
+        elif self.engine == "goertzel":
+            # only the tones themselves are measured, so there is nothing to fine-tune them with
+            streams = [(None, ratios_to_bits(features), None)]
+        else:
+            self._log("Calibrating 1 and 0 frequency targets on the gathered data...")
+            centres, spreads, tolerances = calibrate_tones(features, [one_freq, zero_freq],
+                                                           self.frequency_resolution(fs))
+            one_freq, zero_freq = float(centres[0]), float(centres[1])
+            tolerances = (float(tolerances[0]), float(tolerances[1]))
+            self._log("ZERO_FREQ --> " + str(round(zero_freq, 1)) + " Hz (spread " + str(round(spreads[1], 1)) +
+                      " Hz, tolerance " + str(round(tolerances[1], 1)) + " Hz)")
+            self._log("ONE_FREQ --> " + str(round(one_freq, 1)) + " Hz (spread " + str(round(spreads[0], 1)) +
+                      " Hz, tolerance " + str(round(tolerances[0], 1)) + " Hz)")
+            streams = [(None, classify_freqs(features, one_freq, zero_freq, tolerances), None)]
+        return one_freq, zero_freq, tolerances, streams
+
+    def decode_frame(self, bits, fs, start=0, end=None, metrics=None):
+        """
+        Decodes the per-window bits (M-FSK: symbols, soft: LLRs) of a single frame of a recording sampled at fs,
+        starting with its preamble, start / end in windows (hops, with overlap). The preamble, payload and crc stages
+        are measured in metrics if given.
+        """
+        start = int(start)
+        end = start + len(bits) if end is None else int(end)
+        with measure(metrics, "preamble", len(bits), "windows"):
+            if self.soft:
+                symbols = cut_preamble_soft(bits, self.symbol_windows, self.verbose)
+            else:
+                symbols = cut_preamble(bits, self.symbol_windows, self.verbose, 2 ** self.bits_per_symbol)
+        with measure(metrics, "payload", len(bits), "windows"):
+            payload_plus_crc = detect_payload_plus_crc(symbols, self.verbose, self.bits_per_symbol,
+                                                       self.fec_data_bits)
+        with measure(metrics, "crc", len(bits), "windows"):
+            crc_ok = crc_check(payload_plus_crc, self.verbose)
+        hop = self.hop_seconds(fs)
+        return Frame(round(start * hop, 6), round(end * hop, 6), payload_plus_crc, crc_ok, packet=self.packets)
+
+
+def import_scipy():
+    """
+    Imports the SciPy modules (and the signal analyzer) the stages of a decode use, before the first stage is timed,
+    so their import time isn't measured as part of whichever stage needs them first
+    """
+    import scipy.fft
+    import scipy.io.wavfile
+    import scipy.signal
+    import signal_analyzer
+
+
+def init_pool_worker():
+    """
+    Initializer of every process pool running the demodulator: the pool already keeps every core busy, so the FFTs
+    of a worker run single-threaded instead of competing with each other
+    """
+    global FFT_WORKERS
+    FFT_WORKERS = 1
+    import_scipy()
+
+
+def _analyze_segment(task):
+    """
+    Pool task of Demodulator.analyze_parallel: features of one segment, without its warm-up windows, and the metrics
+    of its stages (None unless trace_memory is given)
+    """
+    demodulator, segment, span, first_sample, fs, warmup, block_seconds, trace_memory = task
+    metrics = None if trace_memory is None else Metrics(trace_memory)
+    if span is not None:
+        filename, dtype, offset, shape = segment
+        segment = np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape)[span[0]:span[1]]
+    return demodulator.analyze(segment, fs, block_seconds, metrics, first_sample)[warmup:], metrics
+
+
+def print_frame(frame):
+    """Prints the received payload of a frame, as text if possible"""
+    payload_string = frame.payload
 
     # what happens if we pass crc
-    if crc_check(payload_plus_crc):
+    if frame.crc_ok:
         print(Fore.GREEN + "CRC's matched!")
         print(Fore.RESET, end="")
         try:
-            ascii = text_from_bits(payload_string)
+            ascii = text_from_bits(frame.payload_bits)
             print("\nReceived ASCII text: ")
             print(Fore.CYAN, end="")
             print(ascii)
@@ -270,18 +1180,227 @@ def process_signal(sampling_frequency, x_signal):
     print("\n\n")
 
 
-if __name__ == "__main__":
-    print("Reading " + FILEPATH)
-    f_s, x = wavfile.read(FILEPATH)
+def print_result(result):
+    """Prints every frame of a DecodeResult"""
+    if not result.frames:
+        print(Fore.YELLOW + "No preamble found, nothing to decode")
+        print(Fore.RESET, end="")
+    for idx, frame in enumerate(result.frames):
+        channel = "" if frame.channel is None else ", channel " + str(frame.channel)
+        seq = "" if frame.seq is None else ", packet " + str(frame.seq)
+        print(Fore.CYAN + "\n===FRAME " + str(idx + 1) + " (" + str(round(frame.start, 2)) + " s - " +
+              str(round(frame.end, 2)) + " s" + channel + seq + ")===")
+        print(Fore.RESET, end="")
+        print_frame(frame)
+
 
-    # "guard bands"
-    if ZERO_FREQ < ONE_FREQ:
-        x = butter_bandpass_filter(x, ZERO_FREQ - abs(ONE_FREQ - ZERO_FREQ), ONE_FREQ + abs(ONE_FREQ - ZERO_FREQ), f_s)
+def print_metrics(metrics):
+    """Prints the wall time, samples processed and peak memory of every stage (see instrumentation.Metrics)"""
+    print(Fore.CYAN + "\n---METRICS---")
+    print(Fore.RESET, end="")
+    for name, stage in metrics.stages.items():
+        memory = "" if stage.peak_memory is None else ", peak " + str(round(stage.peak_memory / 2 ** 20, 1)) + " MB"
+        print(name.ljust(12) + str(round(stage.wall_time, 3)).rjust(8) + " s, " + str(stage.samples) + " " +
+              stage.unit + " (" + str(int(stage.throughput)) + "/s) in " + str(stage.calls) + " call(s)" + memory)
+    print("Total: " + str(round(metrics.elapsed, 3)) + " s")
+
+
+def process_signal(sampling_frequency, x_signal, block_seconds=None, demodulator=None, processes=None, metrics=None):
+    """
+    Main function for processing the raw signal: decodes it (see Demodulator.decode), prints the frames
+    found (and with a verbose demodulator, the metrics of every stage) and returns the DecodeResult.
+    """
+    if demodulator is None:
+        demodulator = Demodulator(verbose=1)
+    result = demodulator.decode(x_signal, sampling_frequency, block_seconds, processes, metrics)
+    print_result(result)
+    if demodulator.verbose:
+        print_metrics(result.metrics)
+    return result
+
+
+def demodulator_parser():
+    """
+    Options of a Demodulator, the block-wise analysis and the feature cache, shared by the command line tools (add it
+    to their parents); see demodulator_kwargs
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--one-freq",
+                        help="Target frquency for binary 1s",
+                        default=5500,
+                        dest="one_freq",
+                        type=int)
+    parser.add_argument("--zero-freq",
+                        help="Target frquency for binary 0s",
+                        default=6500,
+                        dest="zero_freq",
+                        type=int)
+    parser.add_argument("--time-interval",
+                        help="Time intervals into which to slice sound file",
+                        default=0.1,
+                        dest="time_interval",
+                        type=float)
+    parser.add_argument("--engine",
+                        help="Tone detector: full spectrum FFT or Goertzel on the two tones only",
+                        default="fft",
+                        choices=["fft", "goertzel"],
+                        dest="engine",
+                        type=str)
+    parser.add_argument("--interpolation",
+                        help="Estimate the dominant frequency between FFT bins (FFT engine)",
+                        default=None,
+                        choices=[interpolation for interpolation in INTERPOLATIONS if interpolation is not None],
+                        dest="interpolation",
+                        type=str)
+    parser.add_argument("--zero-pad",
+                        help="Zero-pad every analysis window to this many times its length before the FFT",
+                        default=1,
+                        dest="zero_pad",
+                        type=int)
+    parser.add_argument("--block-seconds",
+                        help="Memory-map the recording and filter / analyze it in blocks of this many seconds",
+                        default=None,
+                        dest="block_seconds",
+                        type=float)
+    parser.add_argument("--filter-order",
+                        help="Order of the Butterworth guard band filter",
+                        default=5,
+                        dest="filter_order",
+                        type=int)
+    parser.add_argument("--tones",
+                        help="Comma separated M-FSK tone table (4 or 8 tones), replaces --one-freq / --zero-freq",
+                        default=None,
+                        dest="tones",
+                        type=lambda tones: [int(tone) for tone in tones.split(",")])
+    parser.add_argument("--channels",
+                        help="Comma separated one:zero frequency pairs of simultaneous FDM channels",
+                        default=None,
+                        dest="channels",
+                        type=lambda channels: [tuple(int(freq) for freq in channel.split(":"))
+                                               for channel in channels.split(",")])
+    parser.add_argument("--soft",
+                        help="Decide bits per symbol on integrated log-likelihood ratios instead of per window",
+                        action="store_true",
+                        dest="soft")
+    parser.add_argument("--windows-per-symbol",
+                        help="Analysis windows per transmitted symbol",
+                        default=WINDOWS_PER_SYMBOL,
+                        dest="windows_per_symbol",
+                        type=int)
+    parser.add_argument("--overlap",
+                        help="Start an analysis window every time interval / OVERLAP seconds",
+                        default=1,
+                        dest="overlap",
+                        type=int)
+    parser.add_argument("--band",
+                        help="Analyze this low:high band instead of the guard band around the tones, e.g. to reuse "
+                             "cached features while tuning the tones",
+                        default=None,
+                        dest="band",
+                        type=lambda band: tuple(float(freq) for freq in band.split(":")))
+    parser.add_argument("--decimate",
+                        help="Mix the tone band down to a low IF and decimate it by this factor before the analysis",
+                        default=None,
+                        dest="decimation",
+                        type=int)
+    parser.add_argument("--fec",
+                        help="Hamming decode frames encoded with this many data bits per codeword (e.g. 4, 11, 26)",
+                        default=None,
+                        dest="fec",
+                        type=int)
+    parser.add_argument("--packets",
+                        help="Frames are packets of a file transmission, whose first byte is a sequence number",
+                        action="store_true",
+                        dest="packets")
+    parser.add_argument("--cache-dir",
+                        help="Cache the spectral analysis of recordings in this directory (reused on the next run)",
+                        default=None,
+                        dest="cache_dir",
+                        type=str)
+    parser.add_argument("--cache-size",
+                        help="Size cap of the cache in MB, least recently used entries are evicted beyond it",
+                        default=512,
+                        dest="cache_size",
+                        type=float)
+    return parser
+
+
+def demodulator_kwargs(args):
+    """Demodulator keyword arguments of the options parsed with demodulator_parser"""
+    return dict(one_freq=args.one_freq, zero_freq=args.zero_freq, time_interval=args.time_interval, engine=args.engine,
+                filter_order=args.filter_order, tones=args.tones, channels=args.channels, soft=args.soft,
+                windows_per_symbol=args.windows_per_symbol, fec_data_bits=args.fec, interpolation=args.interpolation,
+                zero_pad=args.zero_pad, overlap=args.overlap, decimation=args.decimation, packets=args.packets,
+                band=args.band)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PowerSupplay demodulator", parents=[demodulator_parser()])
+    parser.add_argument("--filepath",
+                        help="Filepath to the modulated recording",
+                        default="../02_modulation/audio_files/dell_test_100_300.wav",
+                        dest="filepath",
+                        type=str)
+    parser.add_argument("--processes",
+                        help="Split the recording into segments analyzed on this many processes (0: one per core)",
+                        default=None,
+                        dest="processes",
+                        type=int)
+    parser.add_argument("--metrics",
+                        help="Write the wall time, samples and peak memory of every stage to this file (.prom: "
+                             "Prometheus text format, otherwise JSON)",
+                        default=None,
+                        dest="metrics",
+                        type=str)
+    parser.add_argument("--trace-memory",
+                        help="Trace allocations to measure the peak memory of every stage (slows decoding down)",
+                        action="store_true",
+                        dest="trace_memory")
+    parser.add_argument("-v", "--verbose",
+                        help="Also print every corrected window",
+                        action="store_true",
+                        dest="verbose")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from scipy.io import wavfile
+
+    # before any stage is timed, reading included
+    import_scipy()
+
+    # PARSE ARGS TO MATCH YOUR TARGETS
+    args = parse_args(argv)
+    demodulator = Demodulator(verbose=2 if args.verbose else 1, **demodulator_kwargs(args))
+    metrics = Metrics(args.trace_memory)
+
+    if args.cache_dir is not None:
+        from feature_cache import FeatureCache
+
+        # the recording is only read (and analyzed) if its features aren't in the cache yet
+        cache = FeatureCache(args.cache_dir, int(args.cache_size * 2 ** 20))
+        result = demodulator.decode_file(args.filepath, args.block_seconds, args.processes, cache, metrics)
+        print("Signal duration: " + str(round(result.n_samples / result.sampling_frequency, 2)) + " s")
+        print_result(result)
+        print_metrics(metrics)
     else:
-        x = butter_bandpass_filter(x, ONE_FREQ - abs(ONE_FREQ - ZERO_FREQ), ZERO_FREQ + abs(ONE_FREQ - ZERO_FREQ), f_s)
+        print("Reading " + args.filepath)
+        # out-of-core: the recording is memory-mapped and filtered block by block, or segment by segment
+        with metrics.stage("read") as stage:
+            f_s, x = wavfile.read(args.filepath, mmap=args.block_seconds is not None or args.processes is not None)
+            stage.samples += len(x)
+
+        # printing initial information
+        print("# samples: " + str(len(x)))
+        print("Sampling frequency: " + str(f_s) + " Hz")
+        print("Signal duration: " + str(round((len(x) / f_s), 2)) + " s")
+        result = process_signal(f_s, x, args.block_seconds, demodulator, args.processes, metrics)
 
-    # printing initial information
-    print("# samples: " + str(len(x)))
-    print("Sampling frequency: " + str(f_s) + " Hz")
-    print("Signal duration: " + str(round((len(x) / f_s), 2)) + " s")
-    process_signal(f_s, x)
+    if args.metrics is not None:
+        metrics.dump(args.metrics)
+        print("Metrics written to " + args.metrics)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+On-disk cache of the per-window features Demodulator.analyze computes from a recording, so re-running the decision
+stages (frame search, thresholds, FEC, ...) on it skips reading, filtering and the spectral pass:
+>>> cache = FeatureCache("~/.cache/powersupplay")
+>>> result = Demodulator(one_freq=5500, zero_freq=6500).decode_file("capture.wav", cache=cache)
+Entries are compressed .npz files, keyed by the SHA-256 of the recording's content and the analysis parameters
+(see Demodulator.analysis_params). Once the cache grows beyond max_bytes, the least recently used entries are
+evicted. The digest of a recording is remembered in a small entry of its own, named after the recording's path, size
+and modification time, so a recording is only hashed again once it changes (or its digest was evicted).
+"""
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+
+# default size cap of a cache (bytes)
+MAX_BYTES = 512 * 2 ** 20
+
+# recordings are hashed in chunks of this many bytes
+HASH_CHUNK = 2 ** 20
+
+# suffixes of the entries: features, and the digest of a recording
+FEATURES_SUFFIX = ".npz"
+DIGEST_SUFFIX = ".digest"
+
+
+def file_digest(filepath):
+    """SHA-256 of the content of the file at filepath, as a hex string"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as fileobj:
+        for chunk in iter(lambda: fileobj.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureCache(object):
+    """
+    Directory of cached feature arrays, evicted least recently used first beyond max_bytes. Entries are written
+    atomically, so several processes (e.g. batch_demodulate workers) can share a cache.
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def digest(self, filepath):
+        """
+        file_digest of the recording at filepath, looked up in its digest entry if the recording hasn't changed
+        since. Every recording has an entry of its own, written atomically, so processes sharing the cache never
+        overwrite each other's digests.
+        """
+        stat = os.stat(filepath)
+        identity = os.path.abspath(filepath) + ":" + str(stat.st_size) + ":" + str(stat.st_mtime_ns)
+        path = os.path.join(self.directory, hashlib.sha256(identity.encode()).hexdigest()[:32] + DIGEST_SUFFIX)
+        try:
+            with open(path) as fileobj:
+                digest = fileobj.read()
+        except FileNotFoundError:
+            digest = ""
+        if len(digest) == 2 * hashlib.sha256().digest_size:
+            self._touch(path)
+            return digest
+
+        digest = file_digest(filepath)
+        partial = path + "." + str(os.getpid()) + ".part"
+        with open(partial, "w") as fileobj:
+            fileobj.write(digest)
+        os.replace(partial, path)
+        return digest
+
+    def key(self, filepath, params):
+        """Cache key of the features of the recording at filepath, computed with the (JSON-serializable) params"""
+        params_digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return self.digest(filepath)[:32] + "-" + params_digest[:16]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + FEATURES_SUFFIX)
+
+    def get(self, key):
+        """The arrays stored under key as a dict, or None if there are none (or they can't be read)"""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zipfile.BadZipFile):
+            # a damaged entry is treated like a missing one, and replaced by the next put
+            self._remove(path)
+            return None
+
+        self._touch(path)
+        return arrays
+
+    def put(self, key, **arrays):
+        """Stores arrays under key, then evicts entries while the cache is too large"""
+        path = self._path(key)
+        partial = path + "." + str(os.getpid()) + ".part"
+        with open(partial, "wb") as fileobj:
+            np.savez_compressed(fileobj, **arrays)
+        os.replace(partial, path)
+        self.evict()
+
+    def entries(self):
+        """(path, size, last use) of every entry (features and digests), least recently used first"""
+        res = []
+        for name in os.listdir(self.directory):
+            if name.endswith((FEATURES_SUFFIX, DIGEST_SUFFIX)):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                res.append((os.path.join(self.directory, name), stat.st_size, stat.st_mtime))
+        return sorted(res, key=lambda entry: entry[2])
+
+    def size(self):
+        """Total size of all entries (bytes)"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits into max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            self._remove(path)
+
+    @staticmethod
+    def _touch(path):
+        # the modification time marks the last use, the access time isn't reliable on every file system; another
+        # process sharing the cache may have evicted the entry since it was read
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _remove(path):
+        # another process sharing the cache may have removed it already
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,57 @@
+"""
+Forward error correction: vectorized decoder for the systematic, shortened Hamming codes of the modulator's
+fec_encoder.py. A code is identified by its number of data bits per codeword, e.g. 4 -> Hamming(7,4), 8 -> (12,8),
+11 -> (15,11), 26 -> (31,26); every codeword can have one flipped bit corrected.
+"""
+import numpy as np
+
+
+def parity_bits(data_bits):
+    """Number of parity bits of a Hamming code with data_bits data bits per codeword"""
+    r = 2
+    while 2 ** r - r - 1 < data_bits:
+        r += 1
+    return r
+
+
+def parity_check_matrix(data_bits):
+    """
+    Parity check matrix H of shape (r, n): the data bit columns are the smallest r-bit values that aren't powers
+    of two, the parity bit columns form the identity, MSB in the first row
+    """
+    r = parity_bits(data_bits)
+    values = [value for value in range(3, 2 ** r) if value & (value - 1)][:data_bits]
+    values += [2 ** (r - 1 - idx) for idx in range(r)]
+    return ((np.array(values)[None, :] >> np.arange(r - 1, -1, -1)[:, None]) & 1).astype(np.uint8)
+
+
+def decode(bits, data_bits, verbose=0):
+    """
+    Decodes an np.uint8 bit array of whole codewords: corrects one bit error per codeword through its syndrome,
+    then strips the padding (the last 1 and the 0s after it). Returns the data bits.
+    A trailing partial codeword is dropped, unless only its last bit is missing (typically the last symbol of a
+    frame that was cut short), which is then treated like a flipped bit.
+    """
+    h = parity_check_matrix(data_bits)
+    r, n = h.shape
+    bits = np.asarray(bits, dtype=np.uint8)
+    if len(bits) % n == n - 1:
+        bits = np.r_[bits, np.uint8(0)]
+    codewords = bits[:len(bits) - len(bits) % n].reshape(-1, n).copy()
+
+    # syndrome of every codeword as an integer, and the position of the bit with that column in H
+    syndromes = ((codewords @ h.T) % 2) @ (1 << np.arange(r - 1, -1, -1))
+    position = np.full(2 ** r, -1)
+    position[h.T @ (1 << np.arange(r - 1, -1, -1))] = np.arange(n)
+    errors = position[syndromes]
+
+    # syndromes matching no column (possible for shortened codes) mean more than one error, nothing to correct
+    correctable = errors >= 0
+    codewords[np.flatnonzero(correctable), errors[correctable]] ^= 1
+    if verbose:
+        print("Corrected " + str(np.count_nonzero(correctable)) + " of " + str(len(codewords)) + " codewords, " +
+              str(np.count_nonzero((syndromes != 0) & ~correctable)) + " uncorrectable")
+
+    data = codewords[:, :data_bits].ravel()
+    ones = np.flatnonzero(data)
+    return data[:ones[-1]] if len(ones) else data[:0]
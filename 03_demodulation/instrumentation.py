@@ -0,0 +1,186 @@
+"""
+Per-stage instrumentation of the demodulator: wall time, samples processed and peak memory of every stage
+(read, bandpass, split, spectral, calibration, frame_search, preamble, payload, crc), e.g.
+>>> metrics = Metrics(trace_memory=True)
+>>> result = Demodulator().decode_file("capture.wav", metrics=metrics)
+>>> metrics.dump("metrics.prom")
+Stages are accumulated over their calls (one per block, batch or frame), so a block-wise or parallel decode
+reports the same stages as a single pass. What a stage processed is counted in its unit: samples for the signal
+stages, analysis windows from the spectral stage on. Samples of a memory-mapped recording are only read from disk
+once they are filtered, in the bandpass stage. SciPy is imported before the first stage starts (see
+demodulate_bfsk.import_scipy), so no stage includes its import time. frame_search covers the search for the frames
+in the whole recording, preamble the preamble of every frame found.
+"""
+import contextlib
+import json
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak resident set size isn't reported there
+    resource = None
+
+# prefix of the metric names in the Prometheus text format
+PROMETHEUS_PREFIX = "powersupplay_demodulator"
+
+
+class StageMetrics(object):
+    """
+    Wall time, calls, samples (or other units) processed and peak memory (bytes, if traced) of one stage, over all
+    its calls
+    """
+
+    def __init__(self, name, unit="samples"):
+        self.name = name
+        self.unit = unit
+        self.wall_time = 0.0
+        self.calls = 0
+        self.samples = 0
+        self.peak_memory = None
+
+    @property
+    def throughput(self):
+        """Samples processed per second of wall time"""
+        return self.samples / self.wall_time if self.wall_time > 0 else 0.0
+
+    def to_dict(self):
+        return {"wall_time": self.wall_time, "calls": self.calls, "samples": self.samples, "unit": self.unit,
+                "samples_per_second": self.throughput, "peak_memory": self.peak_memory}
+
+
+class Metrics(object):
+    """
+    Stages of one decode, in the order they first ran. With trace_memory, allocations are traced (tracemalloc,
+    which slows allocation-heavy code down a little) and every stage reports the peak memory it allocated on top of
+    what was allocated when it started; stages may be nested.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        # perf_counter of the first stage start and the last stage end
+        self.started = None
+        self.finished = None
+        # [allocated at the start, peak so far] of every stage currently running, innermost last
+        self._running = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, samples=0, unit="samples"):
+        """Measures the code within the with block as a call of stage name, which processed samples units"""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageMetrics(name, unit)
+        if self.trace_memory:
+            allocated, peak = tracemalloc.get_traced_memory()
+            if self._running:
+                self._running[-1][1] = max(self._running[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._running.append([allocated, allocated])
+
+        started = time.perf_counter()
+        if self.started is None:
+            self.started = started
+        try:
+            # the stage is handed out, so samples that are only known at the end can still be added
+            yield stage
+        finally:
+            self.finished = time.perf_counter()
+            stage.wall_time += self.finished - started
+            stage.calls += 1
+            stage.samples += samples
+            if self.trace_memory:
+                allocated, peak = self._running.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                stage.peak_memory = max(stage.peak_memory or 0, peak - allocated)
+                if self._running:
+                    self._running[-1][1] = max(self._running[-1][1], peak)
+                tracemalloc.reset_peak()
+
+    def merge(self, other):
+        """
+        Adds the stages of other (e.g. measured in a worker process) to these: wall times, calls and samples are
+        summed, peak memory is the larger one
+        """
+        for name, stage in other.stages.items():
+            own = self.stages.get(name)
+            if own is None:
+                own = self.stages[name] = StageMetrics(name, stage.unit)
+            own.wall_time += stage.wall_time
+            own.calls += stage.calls
+            own.samples += stage.samples
+            if stage.peak_memory is not None:
+                own.peak_memory = max(own.peak_memory or 0, stage.peak_memory)
+        return self
+
+    @property
+    def elapsed(self):
+        """Wall time from the start of the first stage to the end of the last one in this process"""
+        return self.finished - self.started if self.started is not None else 0.0
+
+    @staticmethod
+    def max_rss():
+        """Peak resident set size of this process so far (bytes), None where it isn't available"""
+        if resource is None:
+            return None
+        # kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def timings(self):
+        """Wall time of every stage, plus the total elapsed time"""
+        res = {name: stage.wall_time for name, stage in self.stages.items()}
+        res["total"] = self.elapsed
+        return res
+
+    def to_dict(self):
+        return {"stages": {name: stage.to_dict() for name, stage in self.stages.items()}, "total": self.elapsed,
+                "max_rss": self.max_rss()}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """The metrics in the Prometheus text exposition format, one series per stage"""
+        series = [("stage_seconds_total", "counter", "Wall time spent in the stage", "wall_time"),
+                  ("stage_calls_total", "counter", "Number of calls of the stage", "calls"),
+                  ("stage_samples_total", "counter", "Samples (or other units) processed by the stage", "samples"),
+                  ("stage_samples_per_second", "gauge", "Samples (or other units) processed per second", "throughput"),
+                  ("stage_peak_memory_bytes", "gauge", "Peak memory allocated by the stage", "peak_memory")]
+        lines = []
+        for metric, kind, description, attr in series:
+            lines += ["# HELP " + prefix + "_" + metric + " " + description,
+                      "# TYPE " + prefix + "_" + metric + " " + kind]
+            for name, stage in self.stages.items():
+                value = getattr(stage, attr)
+                if value is not None:
+                    lines.append(prefix + "_" + metric + '{stage="' + name + '",unit="' + stage.unit + '"} ' +
+                                 repr(float(value)))
+
+        lines += ["# HELP " + prefix + "_seconds Wall time from the start of the first stage to the end of the last",
+                  "# TYPE " + prefix + "_seconds gauge",
+                  prefix + "_seconds " + repr(float(self.elapsed))]
+        max_rss = self.max_rss()
+        if max_rss is not None:
+            lines += ["# HELP " + prefix + "_max_rss_bytes Peak resident set size of the process",
+                      "# TYPE " + prefix + "_max_rss_bytes gauge",
+                      prefix + "_max_rss_bytes " + repr(float(max_rss))]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, filepath, fmt=None):
+        """Writes the metrics to filepath as "json" or "prometheus" text (default: by the extension, .prom or .json)"""
+        if fmt is None:
+            fmt = "prometheus" if filepath.endswith((".prom", ".txt")) else "json"
+        if fmt not in ("json", "prometheus"):
+            raise ValueError("Unknown metrics format: " + str(fmt))
+        with open(filepath, "w") as fileobj:
+            fileobj.write(self.to_json() if fmt == "json" else self.to_prometheus())
+
+
+def measure(metrics, name, samples=0, unit="samples"):
+    """metrics.stage(name, samples, unit), or a context doing nothing if metrics is None"""
+    if metrics is None:
+        return contextlib.nullcontext(StageMetrics(name, unit))
+    return metrics.stage(name, samples, unit)
@@ -13,6 +13,10 @@ Non-blocking mode (start and stop recording):
 ...     recfile2.start_recording()
 ...     time.sleep(5.0)
 ...     recfile2.stop_recording()
+Both modes accept a listener, which is handed every recorded block of raw
+(paInt16) bytes as well, e.g. for online demodulation:
+>>> with rec.open('streaming.wav', 'wb', listener=demodulator.push) as recfile3:
+...     recfile3.record(duration=5.0)
 """
 import pyaudio
 import wave
@@ -29,19 +33,20 @@ class Recorder(object):
         self.rate = rate
         self.frames_per_buffer = frames_per_buffer
 
-    def open(self, fname, mode='wb'):
+    def open(self, fname, mode='wb', listener=None):
         return RecordingFile(fname, mode, self.channels, self.rate,
-                             self.frames_per_buffer)
+                             self.frames_per_buffer, listener)
 
 
 class RecordingFile(object):
     def __init__(self, fname, mode, channels,
-                 rate, frames_per_buffer):
+                 rate, frames_per_buffer, listener=None):
         self.fname = fname
         self.mode = mode
         self.channels = channels
         self.rate = rate
         self.frames_per_buffer = frames_per_buffer
+        self.listener = listener
         self._pa = pyaudio.PyAudio()
         self.wavefile = self._prepare_file(self.fname, self.mode)
         self._stream = None
@@ -62,6 +67,8 @@ class RecordingFile(object):
         for _ in range(int(self.rate / self.frames_per_buffer * duration)):
             audio = self._stream.read(self.frames_per_buffer)
             self.wavefile.writeframes(audio)
+            if self.listener is not None:
+                self.listener(audio)
         return None
 
     def start_recording(self):
@@ -82,6 +89,9 @@ class RecordingFile(object):
     def get_callback(self):
         def callback(in_data, frame_count, time_info, status):
             self.wavefile.writeframes(in_data)
+            # the listener runs on PortAudio's thread, so it must hand the block off quickly
+            if self.listener is not None:
+                self.listener(in_data)
             return in_data, pyaudio.paContinue
 
         return callback
@@ -1,38 +1,195 @@
-from matplotlib import pyplot as plt
+from functools import lru_cache
+
 import numpy as np
-from pydub import AudioSegment
-from scipy.io import wavfile
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, firwin, kaiserord, sosfilt, upfirdn
+
+# matplotlib, pydub and the recorder (PyAudio) are only needed by the plotting and recording helpers and are
+# imported there, so the demodulator can use the filters below without them
 
-from recorder import Recorder
+# heterodyne front end: the band is moved to between IF_LOW and IF_HIGH times the decimated sampling rate (the FFT
+# engine searches from 0.1 on), the decimation lowpass attenuates whatever would alias onto the band by
+# DECIMATOR_ATTENUATION dB
+IF_LOW = 0.1
+IF_HIGH = 0.45
+DECIMATOR_ATTENUATION = 60
+
+# length of the oscillator table of the heterodyne front end
+OSCILLATOR_BLOCK = 4096
 
 
 # recording via Python, if desired
 def record(filepath: str, duration: int):
+    from recorder import Recorder
+
     rec = Recorder(channels=1)
     print("Recording for " + str(duration) + " seconds...")
     with rec.open(filepath, 'wb') as recfile:
         recfile.record(duration)
 
 
-# bandpass filter #1
+# bandpass filter #1, designed as second-order sections and cached, as the same design is requested over and over
+@lru_cache(maxsize=None)
 def butter_bandpass(lowcut, highcut, fs, order=5):
     nyq = 0.5 * fs
     low = lowcut / nyq
     high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
+    sos = butter(order, [low, high], btype='band', output='sos')
+    return sos
 
 
 # bandpass filter #2
 def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    y = lfilter(b, a, data)
+    sos = butter_bandpass(lowcut, highcut, fs, order=order)
+    y = sosfilt(sos, data)
     return y
 
 
+class BandpassFilter(object):
+    """
+    Stateful Butterworth bandpass for filtering a signal incrementally:
+    >>> bandpass = BandpassFilter(5000, 7000, 44100)
+    >>> for block in blocks:
+    ...     filtered = bandpass.process(block)
+    The output is the same as filtering all blocks at once with butter_bandpass_filter.
+    """
+
+    def __init__(self, lowcut, highcut, fs, order=5):
+        self.sos = butter_bandpass(lowcut, highcut, fs, order=order)
+        self.reset()
+
+    def reset(self):
+        """Forget the filter state, e.g. before starting on a new recording"""
+        self._zi = np.zeros((self.sos.shape[0], 2))
+
+    def process(self, block):
+        y, self._zi = sosfilt(self.sos, block, zi=self._zi)
+        return y
+
+
+# lowpass for decimation, designed with the Kaiser window method and cached like the bandpass
+@lru_cache(maxsize=None)
+def decimation_lowpass(passband, stopband, fs, factor):
+    numtaps, beta = kaiserord(DECIMATOR_ATTENUATION, (stopband - passband) / (0.5 * fs))
+    # one more than a multiple of factor, so the outputs of PolyphaseDecimator line up with its inputs
+    numtaps = factor * int(np.ceil((numtaps - 1) / factor)) + 1
+    return firwin(numtaps, (passband + stopband) / 2, window=('kaiser', beta), fs=fs)
+
+
+# lowpass (complex baseband) counterpart of butter_bandpass
+@lru_cache(maxsize=None)
+def butter_lowpass(cutoff, fs, order=5):
+    return butter(order, cutoff / (0.5 * fs), btype='low', output='sos')
+
+
+def max_decimation(lowcut, highcut, fs):
+    """Largest factor Downconverter can decimate the band [lowcut, highcut] of a signal sampled at fs by"""
+    return max(int(fs * (IF_HIGH - IF_LOW) / (highcut - lowcut)), 1)
+
+
+class PolyphaseDecimator(object):
+    """
+    Stateful FIR decimator: filters a signal with taps (one more than a multiple of factor) and keeps every
+    factor-th sample, block by block. Only the kept samples are computed (upfirdn is a polyphase implementation),
+    the input history is carried over, so the output is the same as decimating all blocks at once.
+    Output sample j belongs to input sample j * factor. Complex taps (a bandpass) on a real signal are applied as
+    two real filters, which is cheaper than filtering in complex arithmetic.
+    """
+
+    def __init__(self, taps, factor):
+        self.taps = np.asarray(taps)
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        """Forget the filter state, e.g. before starting on a new recording"""
+        # everything from the oldest input sample the next output depends on
+        self._pending = np.zeros(len(self.taps) - 1)
+
+    def _filter(self, x):
+        if np.iscomplexobj(self.taps) and not np.iscomplexobj(x):
+            return upfirdn(self.taps.real, x, down=self.factor) + 1j * upfirdn(self.taps.imag, x, down=self.factor)
+        return upfirdn(self.taps, x, down=self.factor)
+
+    def process(self, block):
+        x = np.concatenate([self._pending, block])
+        n_out = (len(x) - len(self.taps)) // self.factor + 1
+        if n_out <= 0:
+            self._pending = x
+            return self._filter(x[:0])
+        y = self._filter(x[:(n_out - 1) * self.factor + len(self.taps)])
+        self._pending = x[n_out * self.factor:]
+        return y[(len(self.taps) - 1) // self.factor:][:n_out]
+
+
+class Downconverter(object):
+    """
+    Heterodyne front end: moves the band [lowcut, highcut] of a real signal down to a low intermediate frequency and
+    decimates it by factor, block by block:
+    >>> downconverter = Downconverter(4500, 7500, 44100, 5)
+    >>> for block in blocks:
+    ...     low_if = downconverter.process(block)
+    The band is mixed to complex baseband and decimated in one go: the decimation lowpass is shifted up to the band
+    (complex taps), so only the kept samples are ever computed and mixed down (see PolyphaseDecimator). At the low
+    rate, a Butterworth lowpass of the given order limits the baseband to the band, which is then mixed up to the IF
+    and reduced to its real part. A frequency f of the input shows at f + shift Hz in the output, which is sampled
+    at fs / factor.
+    """
+
+    def __init__(self, lowcut, highcut, fs, factor, order=5):
+        if factor > max_decimation(lowcut, highcut, fs):
+            raise ValueError("Can't decimate the " + str(lowcut) + " - " + str(highcut) + " Hz band by " + str(factor) +
+                             ", at most by " + str(max_decimation(lowcut, highcut, fs)))
+        self.factor = factor
+        self.fs = fs / factor
+        self.center = (lowcut + highcut) / 2
+        half_width = (highcut - lowcut) / 2
+        self.if_freq = IF_LOW * self.fs + half_width
+        self.shift = self.if_freq - self.center
+
+        # after decimation, everything the lowpass passes up to fs / factor - half_width lands outside the band
+        taps = decimation_lowpass(half_width, self.fs - half_width, fs, factor)
+        self.decimator = PolyphaseDecimator(taps * np.exp(2j * np.pi * self.center / fs * np.arange(len(taps))),
+                                            factor)
+        self.sos = butter_lowpass(half_width, self.fs, order=order)
+        self.reset()
+
+    def reset(self, offset=0):
+        """
+        Forget the filter states and restart the oscillators, at input sample offset of the recording (e.g. where a
+        segment of it starts), so their phase matches a pass over the whole recording
+        """
+        self.decimator.reset()
+        self._zi = np.zeros((self.sos.shape[0], 2), dtype=complex)
+        self._n_out = offset / self.factor
+
+    @staticmethod
+    def _oscillator(cycles, start, n):
+        """
+        exp(j 2 pi cycles k) for k = start ... start + n - 1: a table of OSCILLATOR_BLOCK samples rotated to the
+        start of every block, which is much cheaper than a complex exponential per sample. Phases are wrapped before
+        they are scaled, so they keep their precision on long recordings.
+        """
+        table = np.exp(2j * np.pi * ((cycles * np.arange(min(n, OSCILLATOR_BLOCK))) % 1))
+        starts = np.exp(2j * np.pi * ((cycles * (start + np.arange(0, n, OSCILLATOR_BLOCK))) % 1))
+        return (starts[:, None] * table).ravel()[:n]
+
+    def process(self, block):
+        y = self.decimator.process(block)
+        start = self._n_out
+        self._n_out += len(y)
+
+        # output j belongs to input j * factor, where the oscillator of the mixer stands at -center * j * factor
+        down = self._oscillator(-self.center / self.fs, start, len(y))
+        baseband, self._zi = sosfilt(self.sos, y * down, zi=self._zi)
+        up = self._oscillator(self.if_freq / self.fs, start, len(y))
+        # the real part halves the amplitude of the (one-sided) band
+        return 2 * (baseband.real * up.real - baseband.imag * up.imag)
+
+
 # converts a stereo channel wav to a mono channel wav
 def stereo_to_mono(filepath: str):
+    from pydub import AudioSegment
+
     sound = AudioSegment.from_wav(filepath)
     sound = sound.set_channels(1)
     sound.export(filepath, format="wav")
@@ -40,6 +197,9 @@ def stereo_to_mono(filepath: str):
 
 # processes the signal, plots the resulting spectrogram and saves it as a png
 def plot_spectrogram(filepath: str, nfft=2 ** 12):
+    from matplotlib import pyplot as plt
+    from scipy.io import wavfile
+
     # Read the WAV file (mono)
     stereo_to_mono(filepath)
     sampling_frequency, signal_data = wavfile.read(filepath)
@@ -0,0 +1,263 @@
+"""
+Online demodulation: decodes frames while the recording is still running.
+Blocks handed over by the Recorder's stream callback are queued in a bounded ring buffer and
+demodulated by a worker thread, which filters and windows them incrementally:
+>>> demodulator = StreamDemodulator(rate=44100)
+>>> rec = Recorder(channels=1)
+>>> with rec.open('capture.wav', 'wb', listener=demodulator.push) as recfile:
+...     demodulator.start()
+...     recfile.start_recording()
+...     time.sleep(60.0)
+...     recfile.stop_recording()
+...     demodulator.stop()
+A frame is decoded as soon as the signal has been silent for a few symbol periods after it.
+"""
+import argparse
+import threading
+from collections import deque
+
+import numpy as np
+from colorama import Fore
+
+import demodulate_bfsk as demod
+from signal_analyzer import BandpassFilter
+
+
+class RingBuffer(object):
+    """
+    Bounded FIFO of audio blocks. put() never blocks, so it is safe to call from the PyAudio callback;
+    once the buffer is full the oldest block is overwritten and counted as dropped.
+    """
+
+    def __init__(self, capacity=256):
+        self._blocks = deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, block):
+        with self._cond:
+            if len(self._blocks) == self._blocks.maxlen:
+                self.dropped += 1
+            self._blocks.append(block)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest block, or None if nothing arrived within timeout"""
+        with self._cond:
+            if not self._blocks:
+                self._cond.wait(timeout)
+            if not self._blocks:
+                return None
+            return self._blocks.popleft()
+
+
+class StreamDemodulator(object):
+    """
+    Incremental counterpart of demodulate_bfsk.Demodulator.decode, fed with raw paInt16 blocks via push().
+    Tone frequencies, time interval and filter order are taken from demodulator (a default Demodulator if None),
+    which has to demodulate a single BFSK channel.
+    With soft decisions, the noise level of the LLRs (see demodulate_bfsk.tone_llrs) is estimated on the windows of
+    each frame, there is no whole recording to go by.
+    Decoded frames are printed and passed to on_frame(frame) if given.
+    """
+
+    def __init__(self, rate=44100, demodulator=None, capacity=256, silence_symbols=2, on_frame=None):
+        self.rate = rate
+        self.demodulator = demod.Demodulator() if demodulator is None else demodulator
+        if self.demodulator.tones is not None or self.demodulator.channels is not None:
+            raise ValueError("Online demodulation is only supported for single channel BFSK, not M-FSK or FDM")
+        self.on_frame = on_frame
+
+        # with decimation, blocks are downconverted (which also takes care of the bandpass) and analyzed at the lower
+        # rate and shifted tones
+        self.downconverter = self.demodulator.front_end(rate)
+        self.analysis_rate, shift = (rate, 0) if self.downconverter is None else \
+            (self.downconverter.fs, self.downconverter.shift)
+        self.tones = (self.demodulator.one_freq + shift, self.demodulator.zero_freq + shift)
+        self.window_len, self.hop = self.demodulator.window_hop(self.analysis_rate)
+        self.windows_per_symbol = self.demodulator.symbol_windows
+
+        self.buffer = RingBuffer(capacity)
+        if self.downconverter is None:
+            self.bandpass = BandpassFilter(*demod.get_guard_band(*self.tones), rate,
+                                           order=self.demodulator.filter_order)
+        else:
+            self.bandpass = self.downconverter
+        self._pending = np.empty(0)
+        self._windows_seen = 0
+
+        # tone and guard energies of the windows of the frame currently being received (see
+        # demodulate_bfsk.goertzel_tone_energies), and tone presence in the latest windows
+        self._frame = []
+        self._frame_start = 0
+        self._recent = deque(maxlen=silence_symbols * self.windows_per_symbol)
+        self._preamble_seen = False
+        # the latest runs of equal bits as [bit, first window, tone windows], as many as a preamble and the run
+        # after it have
+        self._runs = deque(maxlen=len(demod.PREAMBLE))
+
+        self._running = threading.Event()
+        self._worker = None
+
+    def push(self, in_data):
+        """Recorder listener: queues a block of raw paInt16 bytes, returns immediately"""
+        self.buffer.put(in_data)
+
+    def start(self):
+        self._running.set()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+        return self
+
+    def stop(self):
+        """Demodulates whatever is still queued and flushes a frame that ended with the recording"""
+        self._running.clear()
+        self._worker.join()
+        while True:
+            block = self.buffer.get(timeout=0)
+            if block is None:
+                break
+            self.feed(np.frombuffer(block, dtype=np.int16))
+        self._end_frame()
+        if self.buffer.dropped:
+            print(Fore.YELLOW + "Dropped " + str(self.buffer.dropped) + " blocks, demodulation fell behind")
+            print(Fore.RESET, end="")
+        return self
+
+    def _run(self):
+        while self._running.is_set():
+            block = self.buffer.get(timeout=0.1)
+            if block is not None:
+                self.feed(np.frombuffer(block, dtype=np.int16))
+
+    def feed(self, samples):
+        """Filters a block of samples, carrying the filter state over, and classifies every completed window"""
+        self._pending = np.concatenate([self._pending, self.bandpass.process(samples)])
+
+        frames = demod.frame_signal(self._pending, self.window_len, self.hop)
+        if not len(frames):
+            return
+        energies = demod.goertzel_tone_energies(frames, self.analysis_rate, *self.tones)
+        self._pending = self._pending[len(frames) * self.hop:]
+
+        for window_energies, ratio in zip(energies, demod.tone_ratios(energies)):
+            self._add_window(window_energies, ratio)
+            self._windows_seen += 1
+
+    def _add_window(self, energies, ratio):
+        self._recent.append(ratio != 0)
+        if not self._frame:
+            if ratio == 0:
+                return
+            self._frame_start = self._windows_seen
+        self._frame.append(energies)
+
+        if not self._preamble_seen and ratio != 0 and self._find_preamble(ratio > 0):
+            self._preamble_seen = True
+            print("Preamble detected at " + str(round(self._frame_start * self.hop / self.analysis_rate, 2)) + " s")
+
+        # the frame is over once hardly any of the last silence_symbols symbol periods carried a tone
+        # (single noise windows can pass the guard test, so this can't wait for a clean run of silence)
+        if len(self._frame) >= self._recent.maxlen and sum(self._recent) <= self._recent.maxlen // 4:
+            self._end_frame()
+
+    def _find_preamble(self, bit):
+        """
+        Adds the latest tone window (its bit) to the runs and looks for seven alternating runs of one symbol each,
+        beginning with a 1, followed by another run. Windows before the earliest run a preamble can still start with
+        are trimmed off the frame, so it doesn't grow before a preamble is found.
+        """
+        window = self._windows_seen
+        if self._runs and self._runs[-1][0] == bit:
+            self._runs[-1][2] += 1
+            if np.rint(self._runs[-1][2] / self.windows_per_symbol) > 1:
+                # too long for a preamble symbol, a preamble can only start after this run
+                while len(self._runs) > 1:
+                    self._runs.popleft()
+                self._trim(window)
+                return False
+        else:
+            self._runs.append([bit, window, 1])
+            preamble = list(self._runs)[:-1]
+            if len(preamble) == len(demod.PREAMBLE) - 1 and preamble[0][0] and \
+                    all(np.rint(count / self.windows_per_symbol) == 1 for _, _, count in preamble):
+                self._trim(preamble[0][1])
+                return True
+        self._trim(self._runs[0][1])
+        return False
+
+    def _trim(self, window):
+        """Drops the windows of the frame before window (counted from the start of the recording)"""
+        offset = window - self._frame_start
+        if offset > 0:
+            del self._frame[:offset]
+            self._frame_start = window
+
+    def _end_frame(self):
+        if self._preamble_seen:
+            # the transmission ended at the first silent window of the trailing silence_symbols periods
+            energies = np.array(self._frame)
+            ratios = demod.tone_ratios(energies)
+            silent = np.flatnonzero(ratios[-self._recent.maxlen:] == 0)
+            if len(silent):
+                energies = energies[:max(len(energies) - self._recent.maxlen, 0) + silent[0]]
+                ratios = ratios[:len(energies)]
+
+            # the run search only roughly locates the preamble (noise windows right before it pass as tone),
+            # the matched filter of the batch demodulator pins down where the frame starts
+            if self.demodulator.soft:
+                # the frame search runs on hard decisions, the frame itself is decoded from the LLRs
+                llrs, present = demod.tone_llrs(energies)
+                bits, features = np.where(present, llrs > 0, -1).astype(np.int8), llrs
+            else:
+                bits = features = demod.ratios_to_bits(ratios)
+            for start, end in demod.find_frames(bits, self.windows_per_symbol)[:1]:
+                decoded = self.demodulator.decode_frame(features[start:end], self.rate, self._frame_start + start,
+                                                        self._frame_start + end)
+                demod.print_frame(decoded)
+                if self.on_frame is not None:
+                    self.on_frame(decoded)
+
+        self._frame = []
+        self._preamble_seen = False
+        self._runs.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PowerSupplay online demodulator")
+    parser.add_argument("--one-freq",
+                        help="Target frquency for binary 1s",
+                        default=5500,
+                        dest="one_freq",
+                        type=int)
+    parser.add_argument("--zero-freq",
+                        help="Target frquency for binary 0s",
+                        default=6500,
+                        dest="zero_freq",
+                        type=int)
+    parser.add_argument("--time-interval",
+                        help="Length of the analysis windows",
+                        default=0.1,
+                        dest="time_interval",
+                        type=float)
+    parser.add_argument("--duration",
+                        help="Recording duration in seconds",
+                        default=60.0,
+                        dest="duration",
+                        type=float)
+    parser.add_argument("--output",
+                        help="WAV file the recording is written to",
+                        default="record.wav",
+                        dest="output",
+                        type=str)
+    args = parser.parse_args()
+
+    from recorder import Recorder
+
+    rec = Recorder(channels=1)
+    demodulator = StreamDemodulator(rate=rec.rate, demodulator=demod.Demodulator(
+        one_freq=args.one_freq, zero_freq=args.zero_freq, time_interval=args.time_interval)).start()
+    print("Recording and demodulating for " + str(args.duration) + " seconds...")
+    with rec.open(args.output, 'wb', listener=demodulator.push) as recfile:
+        recfile.record(args.duration)
+    demodulator.stop()
@@ -0,0 +1,117 @@
+"""
+Tests of the demodulator: $ python -m pytest
+The round trip frames its payload with the modulator's framing.py (02_modulation) and synthesizes the power supply
+emission of the CPU load switching, so it checks both ends against each other.
+"""
+import os
+import sys
+
+import numpy as np
+
+import demodulate_bfsk as demod
+import fec_decoder
+
+# the modulator's modules, to check both ends against each other
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "02_modulation"))
+import fec_encoder  # noqa: E402
+import framing  # noqa: E402
+
+FS = 44100
+
+
+def switching_signal(bits, one_freq, zero_freq, symbol_seconds, fs=FS, lead=1.0, tail=3.0, noise=0.3, seed=0):
+    """
+    Emission of a BFSK transmission: a square wave at the switching frequency of every symbol, between lead and
+    tail seconds of silence, in white noise
+    """
+    rng = np.random.default_rng(seed)
+    symbol_len = int(fs * symbol_seconds)
+    freqs = np.repeat([one_freq if bit == "1" else zero_freq for bit in bits], symbol_len)
+    # phase continuous from symbol to symbol
+    wave = np.sign(np.sin(2 * np.pi * np.cumsum(freqs) / fs))
+    x = np.concatenate([np.zeros(int(lead * fs)), wave, np.zeros(int(tail * fs))])
+    x = x + noise * rng.standard_normal(len(x))
+    return (x / np.abs(x).max() * 20000).astype(np.int16)
+
+
+def test_crc8_check_value():
+    # the check value of CRC-8/SMBUS, the same on both ends
+    assert demod.crc8(b"123456789") == 0xF4
+    assert framing.crc8(b"123456789") == 0xF4
+
+
+def test_crc_check():
+    packet = framing.build_packet(0, b"Hi!")
+    bits = np.unpackbits(np.frombuffer(packet, dtype=np.uint8))
+    assert demod.crc_check(bits)
+    bits[3] ^= 1
+    assert not demod.crc_check(bits)
+
+
+def test_fec_round_trip():
+    rng = np.random.default_rng(0)
+    for data_bits in (4, 8, 11, 26):
+        data = "".join(rng.choice(["0", "1"], 100))
+        codewords = np.array([int(bit) for bit in fec_encoder.encode(data, data_bits)], dtype=np.uint8)
+        n = data_bits + fec_decoder.parity_bits(data_bits)
+        # one flipped bit in every codeword, anywhere in it
+        codewords[np.arange(0, len(codewords), n) + rng.integers(0, n, len(codewords) // n)] ^= 1
+        decoded = fec_decoder.decode(codewords, data_bits)
+        assert "".join(str(bit) for bit in decoded) == data
+
+
+def test_round_trip():
+    packet = framing.build_packet(7, b"Hi!")
+    bits = framing.PREAMBLE + framing.to_bits(packet)
+    samples = switching_signal(bits, 5500, 6500, symbol_seconds=0.2)
+
+    demodulator = demod.Demodulator(one_freq=5500, zero_freq=6500, time_interval=0.02, windows_per_symbol=10,
+                                    packets=True)
+    result = demodulator.decode(samples, FS)
+
+    assert len(result.frames) == 1
+    frame = result.frames[0]
+    assert frame.crc_ok
+    assert frame.seq == 7
+    assert frame.text == "Hi!"
+    assert abs(frame.start - 1.0) < 0.2
+
+
+def test_soft_decisions_do_not_depend_on_blocks():
+    # the noise level of the LLRs is estimated on the whole recording, not per block of the analysis
+    packet = framing.build_packet(1, b"ok")
+    samples = switching_signal(framing.PREAMBLE + framing.to_bits(packet), 5500, 6500, symbol_seconds=0.2, noise=2.0)
+    demodulator = demod.Demodulator(time_interval=0.02, windows_per_symbol=10, soft=True)
+
+    whole, _ = demod.tone_llrs(demodulator.extract_features(samples, FS))
+    blocks, _ = demod.tone_llrs(demodulator.extract_features(samples, FS, block_seconds=0.5))
+    assert np.allclose(whole, blocks, atol=1e-3)
+    assert [frame.crc_ok for frame in demodulator.decode(samples, FS, block_seconds=0.5).frames] == [True]
+
+
+def test_frame_times_follow_the_hop_in_samples():
+    # 0.02 s windows at 11025 Hz are 220 samples long, 19.95 ms: frame times counted in nominal 20 ms windows
+    # would drift by 0.14 s within the minute before the frame
+    fs = 11025
+    packet = framing.build_packet(2, b"ok")
+    samples = switching_signal(framing.PREAMBLE + framing.to_bits(packet), 2000, 3000, symbol_seconds=0.2, fs=fs,
+                               lead=60.0)
+    demodulator = demod.Demodulator(one_freq=2000, zero_freq=3000, time_interval=0.02, windows_per_symbol=10)
+    result = demodulator.decode(samples, fs)
+
+    assert [frame.crc_ok for frame in result.frames] == [True]
+    assert abs(result.frames[0].start - 60.0) < 0.02
+
+
+def test_calibration_after_long_silence():
+    # ten minutes of noise outweigh the frame's windows in the histogram of the dominant frequencies, the tones
+    # still have to stand out above its noise floor
+    fs = 11025
+    packet = framing.build_packet(5, b"ok")
+    samples = switching_signal(framing.PREAMBLE + framing.to_bits(packet), 2000, 3000, symbol_seconds=0.2, fs=fs,
+                               lead=600.0)
+    demodulator = demod.Demodulator(one_freq=2000, zero_freq=3000, time_interval=0.02, windows_per_symbol=10)
+    result = demodulator.decode(samples, fs)
+
+    assert max(result.tolerances) <= demod.TONE_TOLERANCE
+    assert [frame.crc_ok for frame in result.frames] == [True]
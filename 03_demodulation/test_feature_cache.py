@@ -0,0 +1,26 @@
+"""Tests of the feature cache: $ python -m pytest"""
+import os
+
+import numpy as np
+
+from feature_cache import DIGEST_SUFFIX, FeatureCache, file_digest
+
+
+def test_digests_are_entries(tmp_path):
+    recording = tmp_path / "capture.wav"
+    recording.write_bytes(b"RIFF" + bytes(1000))
+    cache = FeatureCache(tmp_path / "cache", max_bytes=10000)
+
+    assert cache.digest(recording) == file_digest(recording)
+    # remembered in an entry of its own, counted towards the size of the cache
+    assert [os.path.splitext(path)[1] for path, _, _ in cache.entries()] == [DIGEST_SUFFIX]
+    assert cache.size() == 64
+    assert cache.digest(recording) == file_digest(recording)
+    assert len(cache.entries()) == 1
+
+    # the digest is evicted like the features once it is the least recently used entry
+    rng = np.random.default_rng(0)
+    for idx in range(4):
+        cache.put("features-" + str(idx), features=rng.random(1000))
+    assert all(not path.endswith(DIGEST_SUFFIX) for path, _, _ in cache.entries())
+    assert cache.size() <= cache.max_bytes
@@ -0,0 +1,53 @@
+"""Tests of the online demodulator: $ python -m pytest"""
+import numpy as np
+import pytest
+
+import demodulate_bfsk as demod
+from stream_demodulator import StreamDemodulator
+from test_demodulate_bfsk import FS, framing, switching_signal
+
+# samples per block, as handed over by the recorder
+BLOCK = 4096
+
+
+def feed(demodulator, samples):
+    for start in range(0, len(samples), BLOCK):
+        demodulator.feed(samples[start:start + BLOCK])
+
+
+def test_stream_round_trip():
+    packet = framing.build_packet(3, b"Hi!")
+    samples = switching_signal(framing.PREAMBLE + framing.to_bits(packet), 5500, 6500, symbol_seconds=0.2)
+    frames = []
+    demodulator = StreamDemodulator(FS, demod.Demodulator(time_interval=0.02, packets=True), on_frame=frames.append)
+    feed(demodulator, samples)
+
+    assert [(frame.crc_ok, frame.seq, frame.text) for frame in frames] == [(True, 3, "Hi!")]
+
+
+def test_continuous_tone_stays_bounded():
+    # a tone without a preamble never starts a frame, the windows received so far are dropped as they come
+    samples = switching_signal("1" * 300, 5500, 6500, symbol_seconds=0.2, tail=0)
+    demodulator = StreamDemodulator(FS, demod.Demodulator(time_interval=0.02))
+    feed(demodulator, samples)
+
+    assert not demodulator._preamble_seen
+    assert len(demodulator._frame) <= 2 * demodulator.windows_per_symbol
+
+
+def test_stream_soft_decisions():
+    packet = framing.build_packet(4, b"Hi!")
+    samples = switching_signal(framing.PREAMBLE + framing.to_bits(packet), 5500, 6500, symbol_seconds=0.2, noise=2.0)
+    frames = []
+    demodulator = StreamDemodulator(FS, demod.Demodulator(time_interval=0.02, soft=True, packets=True),
+                                    on_frame=frames.append)
+    feed(demodulator, samples)
+
+    assert [(frame.crc_ok, frame.seq, frame.text) for frame in frames] == [(True, 4, "Hi!")]
+
+
+def test_stream_rejects_mfsk_and_fdm():
+    with pytest.raises(ValueError):
+        StreamDemodulator(FS, demod.Demodulator(tones=[4000, 5000, 6000, 7000]))
+    with pytest.raises(ValueError):
+        StreamDemodulator(FS, demod.Demodulator(channels=[(5500, 6500), (8500, 9500)]))